@@ -1,9 +1,46 @@
 import streamlit as st
-from dataLoading import load_wallet_data, extract_wallet_features, classify_wallet
+from dataLoading import (
+    load_env, load_wallet_store, extract_wallet_features, data_fingerprint, normalize_address,
+    get_response_cache
+)
+from caching import TTLCache
+from tracing import REGISTRY, profile_request, span
+from wallet_persona_ai import get_generator
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
+load_env()
+DATA_DIR = "data"
+
+
+@st.cache_resource
+def get_caches():
+    """Process-wide caches shared by every rerun, session and user.
+
+    ``tables`` holds loaded WalletStores keyed by data-dir fingerprint (so an
+    updated CSV is picked up on the next request); ``features`` holds computed
+    WalletFeatures records keyed by (fingerprint, normalized address).
+    """
+    return {
+        "tables": TTLCache(maxsize=2),
+        "features": TTLCache(maxsize=2048, ttl=15 * 60),
+    }
+
+
+def get_wallet_features(wallet_address):
+    """Features for ``wallet_address``, served from the shared caches when possible."""
+    caches = get_caches()
+    fingerprint = data_fingerprint(DATA_DIR)
+    data_dict = caches["tables"].get_or_compute(fingerprint, lambda: load_wallet_store(data_dir=DATA_DIR))
+    features = caches["features"].get_or_compute(
+        (fingerprint, normalize_address(wallet_address)),
+        lambda: extract_wallet_features(wallet_address, data_dict),
+    )
+    # The cache holds compact records; the page works with a plain dict copy.
+    return data_dict, features.to_dict()
+
+
 st.set_page_config(page_title="Onchain Wallet Persona Generator", layout="wide")
 st.title("🦄 Onchain Wallet Persona Generator")
 st.markdown(
@@ -13,24 +50,29 @@ st.markdown(
 )
 
 wallet_address = st.text_input("Wallet Address", placeholder="0x...")
+use_llm = st.checkbox("Also write an AI persona with the language model (slow without a GPU)")
 
 if st.button("Generate Persona"):
     if not wallet_address or not wallet_address.startswith("0x") or len(wallet_address) < 10:
         st.error("Please enter a valid wallet address.")
     else:
-        with st.spinner("Analyzing wallet and generating persona..."):
-            data_dict = load_wallet_data(data_dir="data")
+        with st.spinner("Analyzing wallet and generating persona..."), profile_request("app"), span("app.request"):
             try:
-                features = extract_wallet_features(wallet_address, data_dict)
+                with span("app.features"):
+                    data_dict, features = get_wallet_features(wallet_address)
                 if features:
-                    features['classifications'] = classify_wallet(features)
-
                     # Persona summary
                     st.subheader("Persona Profile")
                     st.markdown(f"*Social Handle:* {features.get('social_handle', 'N/A')}")
                     st.markdown(f"*Classifications:* {', '.join(features.get('classifications', []))}")
                     st.markdown(f"*Persona Profile:*\n\n{features.get('persona_profile', 'N/A')}")
 
+                    if use_llm:
+                        # Stream tokens into the page as they are generated.
+                        st.subheader("AI Persona")
+                        with span("app.llm_stream"):
+                            st.write_stream(get_generator().stream_persona(features))
+
                     # Scores & Risk Assessment
                     show_scores = any([
                         features.get('wallet_health_score', 0),
@@ -116,7 +158,7 @@ if st.button("Generate Persona"):
                         "token_symbol" in token_df.columns and
                         "usd_value" in token_df.columns
                     ):
-                        user_tokens = token_df[token_df["wallet"] == wallet_address]
+                        user_tokens = data_dict.wallet_rows("tokens", wallet_address)
                         top_tokens = user_tokens.groupby("token_symbol")["usd_value"].sum()
                         top_tokens = top_tokens[top_tokens > 0].sort_values(ascending=False).head(10)
                         if not top_tokens.empty:
@@ -175,4 +217,16 @@ if st.button("Generate Persona"):
             except ValueError as e:
                 st.warning(str(e))
             except Exception:
-                st.warning("An unexpected error occurred. Please check the wallet address and try again.")
\ No newline at end of file
+                st.warning("An unexpected error occurred. Please check the wallet address and try again.")
+
+with st.sidebar.expander("Cache stats (debug)"):
+    for name, cache in {**get_caches(), "moralis responses": get_response_cache()}.items():
+        if cache is None:
+            continue
+        st.markdown(f"**{name}**")
+        st.json(cache.stats())
+
+with st.sidebar.expander("Stage timings (debug)"):
+    st.json(REGISTRY.snapshot())
+    st.download_button("Prometheus metrics", REGISTRY.to_prometheus(), file_name="metrics.prom")
+    st.download_button("JSON lines", REGISTRY.to_json_lines(), file_name="metrics.jsonl")
@@ -0,0 +1,156 @@
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from caching import ApiWrapper
+from dataLoading import (
+    API_COSTS, API_ENDPOINTS, API_FETCHERS, DATA_FILES, DELTA_DIR_NAME, LISTING_SUMMARIES, RateLimitedApi,
+    TokenBucket, api_calls, api_chains, append_csv, compact_deltas, merge_chain_results, moralis_api,
+    moralis_api_key, read_wallet_list,
+)
+
+CHECKPOINT_FILE = ".backfill_checkpoint"
+
+
+def read_checkpoint(path):
+    """Wallets already written by a previous run."""
+    if not path.exists():
+        return set()
+    return {line.strip() for line in path.read_text().splitlines() if line.strip()}
+
+
+class RetryingApi(ApiWrapper):
+    """Wraps a ``moralis.evm_api``-shaped object so each endpoint call is retried on failure.
+
+    Failures back off exponentially with jitter; the last error is re-raised.
+    Listings are fetched one call per page, so a failed page is retried on
+    its own instead of restarting the listing.
+    """
+
+    def __init__(self, api, retries=3, backoff=1.0):
+        super().__init__(api)
+        self._retries = retries
+        self._backoff = backoff
+
+    def call(self, endpoint, target, *args, **kwargs):
+        for attempt in range(self._retries + 1):
+            try:
+                return target(*args, **kwargs)
+            except Exception:
+                if attempt == self._retries:
+                    raise
+                time.sleep(self._backoff * 2 ** attempt * (1 + random.random()))
+
+
+def fetch_wallet(wallet_address, api, api_key, chains):
+    """All tables for one wallet across ``chains``; raises if any call exhausts its retries.
+
+    The backfill rebuilds the tables every later load reads, so token and NFT
+    listings are kept whole rather than trimmed to the top rows.
+    """
+    results = {}
+    for name, chain in api_calls(chains):
+        kwargs = {"keep": None} if name in LISTING_SUMMARIES else {}
+        results[name, chain] = API_FETCHERS[name](api, api_key, wallet_address, chain, **kwargs)
+    return merge_chain_results(wallet_address, results)
+
+
+class TableWriter:
+    """Writes fetched rows to the ``.delta`` tables that ``load_wallet_data`` reads.
+
+    A wallet's delta rows replace its rows in the base CSVs, so refreshing a
+    wallet does not leave its old net worth or stats next to the new ones;
+    ``compact_deltas`` folds them in for good.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = Path(data_dir)
+        self._lock = threading.Lock()
+
+    def append(self, tables):
+        with self._lock:
+            for name, df in tables.items():
+                if df is None or df.empty:
+                    continue
+                append_csv(self.data_dir / DELTA_DIR_NAME / DATA_FILES[name], df)
+
+
+def backfill(wallets, data_dir="data", concurrency=4, cu_per_second=1000, retries=3, backoff=1.0,
+             checkpoint=None, api=None, chains=None):
+    """Fetch every wallet in ``wallets`` and append the results to ``data_dir``.
+
+    Wallets listed in the checkpoint file are skipped, and each wallet is
+    checkpointed only after all of its tables are written, so a crashed run
+    resumes where it stopped. Returns (written, failed) wallet lists.
+    """
+    api_key = moralis_api_key(required=api is None)
+    # Every request, including each page of a listing, takes its compute units and is retried alone.
+    limiter = TokenBucket(cu_per_second)
+    costs = {API_ENDPOINTS[name]: cost for name, cost in API_COSTS.items()}
+    api = RetryingApi(RateLimitedApi(api or moralis_api(), limiter, costs), retries, backoff)
+    chains = tuple(chains or api_chains())
+    checkpoint = Path(checkpoint or Path(data_dir) / CHECKPOINT_FILE)
+    done = read_checkpoint(checkpoint)
+    pending = [w for w in dict.fromkeys(wallets) if w not in done]
+    # Start from compacted tables so the deltas hold one fetch per wallet: this run's.
+    compact_deltas(data_dir)
+    print(f"{len(wallets)} wallets, {len(wallets) - len(pending)} already done, {len(pending)} to fetch")
+
+    writer = TableWriter(data_dir)
+    written, failed = [], []
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, open(checkpoint, "a") as checkpoint_file:
+        futures = {
+            executor.submit(fetch_wallet, wallet, api, api_key, chains): wallet
+            for wallet in pending
+        }
+        for future in as_completed(futures):
+            wallet = futures[future]
+            try:
+                tables = future.result()
+            except Exception as e:
+                print(f"Failed {wallet}: {e}")
+                failed.append(wallet)
+                continue
+            writer.append(tables)
+            checkpoint_file.write(wallet + "\n")
+            checkpoint_file.flush()
+            written.append(wallet)
+            if len(written) % 50 == 0:
+                rate = len(written) / (time.monotonic() - start)
+                print(f"{len(written)}/{len(pending)} wallets written ({rate:.1f} wallets/sec)")
+
+    compact_deltas(data_dir)
+    print(f"Done: {len(written)} written, {len(failed)} failed in {time.monotonic() - start:.1f}s")
+    return written, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill wallet tables from the Moralis API")
+    parser.add_argument("--wallets-file", type=str, default="data/wallets.csv", help="CSV of wallet addresses")
+    parser.add_argument("--data-dir", type=str, default="data", help="Directory with wallet data tables")
+    parser.add_argument("--concurrency", type=int, default=4, help="Wallets fetched in parallel")
+    parser.add_argument("--cu-per-second", type=float, default=1000, help="Moralis compute-unit budget per second")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per endpoint call")
+    parser.add_argument("--backoff", type=float, default=1.0, help="Initial retry backoff in seconds")
+    parser.add_argument("--checkpoint", type=str, help="Checkpoint file (default: <data-dir>/.backfill_checkpoint)")
+    parser.add_argument("--chains", type=str, nargs="+", help="Moralis chains to fetch (default: MORALIS_CHAINS or all)")
+    args = parser.parse_args()
+
+    backfill(
+        read_wallet_list(args.wallets_file),
+        data_dir=args.data_dir,
+        concurrency=args.concurrency,
+        cu_per_second=args.cu_per_second,
+        retries=args.retries,
+        backoff=args.backoff,
+        checkpoint=args.checkpoint,
+        chains=args.chains,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
+
+from dataLoading import (
+    DATA_FILES, TokenBucket, WalletStore, api_chains, build_wallet_db, classify_wallet, extract_features_batch,
+    extract_wallet_features, fetch_wallet_data_from_api, generate_persona_profile, load_wallet_data,
+    open_wallet_db, read_wallet_list,
+)
+
+# Synthetic datasets are written under the (git-ignored) columnar cache directory.
+SYNTHETIC_DIR = Path("data") / ".cache" / "synthetic"
+
+# Tables whose rows belong to a wallet, and the column holding it.
+WALLET_COLUMNS = {
+    "networth": "wallet",
+    "tokens": "wallet",
+    "defi": "wallet",
+    "stats": "wallet",
+    "active_chains": "wallet",
+    "token_summary": "wallet",
+    "nft_summary": "wallet",
+    "wallets": "wallet_ID",
+    "nfts": "wallet_address",
+}
+
+
+def time_per_item(func, items, repeat=3):
+    """Best-of-``repeat`` seconds per item for ``func(item)`` over ``items``."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    return best / max(len(items), 1)
+
+
+def time_once(func, repeat=3):
+    """Best-of-``repeat`` seconds for one call of ``func()``."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_synthetic_dataset(scale, source_dir="data", out_dir=None):
+    """Write a copy of ``source_dir`` with every table ``scale`` times larger.
+
+    Copy ``i`` of each wallet gets ``i`` stamped into the first hex digits of
+    its address, so wallets stay distinct and keep their per-wallet row
+    counts. Tables without a wallet column are simply repeated. Existing
+    output is reused.
+    """
+    out_dir = Path(out_dir or SYNTHETIC_DIR / f"x{scale}")
+    if (out_dir / DATA_FILES["wallets"]).exists():
+        return out_dir
+    out_dir.mkdir(parents=True, exist_ok=True)
+    source = load_wallet_data(source_dir, use_cache=False)
+    for name, filename in DATA_FILES.items():
+        df = source[name]
+        if df.empty:
+            continue
+        column = WALLET_COLUMNS.get(name)
+        copies = []
+        for i in range(scale):
+            copy = df.copy()
+            if column in copy.columns and i:
+                copy[column] = "0x" + f"{i:08x}" + copy[column].astype(str).str[10:]
+            copies.append(copy)
+        pd.concat(copies, ignore_index=True).to_csv(out_dir / filename, index=False)
+    return out_dir
+
+
+def offline_api(latency=0.0):
+    """A stand-in for ``moralis.evm_api`` that answers every call after ``latency`` seconds."""
+    def endpoint(response):
+        def call(api_key=None, params=None):
+            time.sleep(latency)
+            return response
+        return call
+
+    tokens = [{"symbol": f"TK{i}", "token_address": f"0x{i:040x}", "usd_value": float(i)} for i in range(50)]
+    return SimpleNamespace(
+        wallets=SimpleNamespace(
+            get_wallet_token_balances_price=endpoint({"result": tokens}),
+            get_wallet_net_worth=endpoint({"total_networth_usd": "12345.6", "chains": [
+                {"chain": "eth", "native_balance_formatted": "1.5", "token_balance_usd": "2000", "networth_usd": "12345.6"}
+            ]}),
+            get_wallet_stats=endpoint({"nfts": "3", "collections": "2", "transactions": {"total": "120"},
+                                       "nft_transfers": {"total": "4"}, "token_transfers": {"total": "60"}}),
+        ),
+        nft=SimpleNamespace(get_wallet_nft_collections=endpoint({"result": [{"token_address": "0xabc", "count": 1}]})),
+    )
+
+
+def run_cases(data_dir, sample=500, repeat=3, api_latency=0.02):
+    """Run every benchmark case against one dataset and return result records."""
+    results = []
+
+    def record(case, seconds, items=1, **extra):
+        results.append({
+            "case": case,
+            "seconds": round(seconds, 6),
+            "items": items,
+            "us_per_item": round(seconds / max(items, 1) * 1e6, 2),
+            **extra,
+        })
+
+    record("load_wallet_data[csv]", time_once(lambda: load_wallet_data(data_dir, use_cache=False), repeat))
+    load_wallet_data(data_dir)  # build the columnar cache
+    record("load_wallet_data[cached]", time_once(lambda: load_wallet_data(data_dir), repeat))
+
+    data = load_wallet_data(data_dir)
+    record("WalletStore.__init__", time_once(lambda: WalletStore(data), repeat))
+    record("WalletStore.cohort[build]", time_once(lambda: WalletStore(data).cohort, repeat))
+    store = WalletStore(data)
+    store.cohort  # score against the same percentile sketch every case uses
+    wallets = read_wallet_list(Path(data_dir) / DATA_FILES["wallets"])
+    rows = sum(len(df) for df in data.values())
+    sampled = random.Random(0).sample(wallets, min(sample, len(wallets)))
+
+    scan = time_per_item(lambda w: extract_wallet_features(w, data), sampled[:50], 1)
+    record("extract_wallet_features[dict]", scan * len(sampled[:50]), len(sampled[:50]), rows=rows)
+    per_wallet = time_per_item(lambda w: extract_wallet_features(w, store), sampled, repeat)
+    record("extract_wallet_features[store]", per_wallet * len(sampled), len(sampled), rows=rows)
+    record("extract_features_batch", time_once(lambda: extract_features_batch(wallets, store), repeat),
+           len(wallets), rows=rows)
+
+    record("build_wallet_db", time_once(lambda: build_wallet_db(data_dir), 1))
+    record("open_wallet_db", time_once(lambda: open_wallet_db(data_dir).close(), repeat))
+    db = open_wallet_db(data_dir)
+    per_wallet = time_per_item(lambda w: extract_wallet_features(w, db), sampled, repeat)
+    record("extract_wallet_features[sqlite]", per_wallet * len(sampled), len(sampled), rows=rows)
+    record("extract_features_batch[sqlite]", time_once(lambda: extract_features_batch(wallets, db), repeat),
+           len(wallets), rows=rows)
+    db.close()
+
+    features = [extract_wallet_features(w, store) for w in sampled]
+    record("classify_wallet", time_per_item(classify_wallet, features, repeat) * len(features), len(features))
+    profile = time_per_item(lambda f: generate_persona_profile(f, f["classifications"]), features, repeat)
+    record("generate_persona_profile", profile * len(features), len(features))
+
+    api = offline_api(api_latency)
+    # An unlimited bucket, so the case measures the fan-out rather than the compute-unit budget.
+    limiter = TokenBucket(1e12)
+    fetch = time_per_item(
+        lambda w: fetch_wallet_data_from_api(w, api=api, use_cache=False, limiter=limiter), sampled[:20], 1)
+    record("fetch_wallet_data_from_api[offline]", fetch * min(20, len(sampled)), min(20, len(sampled)),
+           api_latency=api_latency, chains=len(api_chains()))
+    return results
+
+
+def current_rss_mb():
+    """Resident memory of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_llm_cases(data_dir, backends, model_id=None, wallets=4, detailed=True):
+    """Run the same feature dicts through each persona backend, one backend at a time.
+
+    ``backends`` are names from ``wallet_persona_ai.BACKENDS``, optionally as
+    ``name=model`` to give that backend its own model (e.g. a GGUF path for
+    ``llamacpp``). Records load time, resident memory added by the load, time
+    to first token and per-persona latency with the output cache disabled.
+    """
+    from wallet_persona_ai import WalletPersonaGenerator
+
+    store = WalletStore(load_wallet_data(data_dir))
+    addresses = read_wallet_list(Path(data_dir) / DATA_FILES["wallets"])
+    features = [extract_wallet_features(w, store) for w in random.Random(0).sample(addresses, wallets)]
+
+    try:
+        # Import the framework first so its cost is not charged to the first backend loaded.
+        import transformers  # noqa: F401
+    except ImportError:
+        pass
+
+    results = []
+    for spec in backends:
+        name, _, model = spec.partition("=")
+        generator = WalletPersonaGenerator(model_id=model or model_id,
+                                           backend=name, cache_path=None)
+        rss_before = current_rss_mb()
+        try:
+            load_seconds = time_once(generator.load, 1)
+        except Exception as e:
+            print(f"Skipping backend {name}: {e!r}")
+            continue
+        rss_mb = current_rss_mb() - rss_before
+
+        start = time.perf_counter()
+        next(generator.stream_persona(features[0], detailed, use_cache=False))
+        ttft = time.perf_counter() - start
+        seconds = time_once(lambda: generator.generate_personas(features, detailed, use_cache=False), 1)
+        results.append({
+            "case": f"generate_personas[{name}]",
+            "seconds": round(seconds, 6),
+            "items": len(features),
+            "us_per_item": round(seconds / len(features) * 1e6, 2),
+            "model": generator.model_id,
+            "load_seconds": round(load_seconds, 3),
+            "rss_mb": round(rss_mb, 1),
+            "time_to_first_token": round(ttft, 4),
+        })
+        del generator
+        gc.collect()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold=1.2):
+    """Print per-case ratios against a previous results file; return the regressions."""
+    previous = {(r["scale"], r["case"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = previous.get((r["scale"], r["case"]))
+        if not old or not old["us_per_item"]:
+            continue
+        ratio = r["us_per_item"] / old["us_per_item"]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"x{r['scale']:<5} {r['case']:<40} {old['us_per_item']:>12.2f} -> {r['us_per_item']:>12.2f} us"
+              f"  ({ratio:.2f}x){flag}")
+        if flag:
+            regressions.append(r)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data loading, feature extraction and persona generation")
+    parser.add_argument("--data-dir", type=str, default="data", help="Directory with the bundled wallet data")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10],
+                        help="Dataset sizes relative to the bundled CSVs (e.g. 1 10 100 1000)")
+    parser.add_argument("--sample", type=int, default=500, help="Wallets timed in the per-wallet cases")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions (best is reported)")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="Simulated seconds per offline API call")
+    parser.add_argument("--output", type=str, help="Write results as JSON to this file")
+    parser.add_argument("--compare", type=str, help="Previous JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    parser.add_argument("--llm-backends", type=str, nargs="+",
+                        help="Compare persona backends instead (e.g. hf int8 llamacpp=model.gguf)")
+    parser.add_argument("--llm-model", type=str, help="Model id or path for backends given without one")
+    parser.add_argument("--llm-wallets", type=int, default=4, help="Wallets generated per backend")
+    parser.add_argument("--llm-simple", action="store_true", help="Use the short persona prompt")
+    args = parser.parse_args()
+
+    results = []
+    if args.llm_backends:
+        args.scales = []
+        for r in run_llm_cases(args.data_dir, args.llm_backends, args.llm_model, args.llm_wallets,
+                               detailed=not args.llm_simple):
+            r["scale"] = 1
+            results.append(r)
+            print(f"{r['case']:<30} load {r['load_seconds']:>8.2f} s  +{r['rss_mb']:>9.1f} MB  "
+                  f"first token {r['time_to_first_token']:>7.3f} s  {r['us_per_item'] / 1e6:>8.3f} s/persona")
+    for scale in args.scales:
+        data_dir = args.data_dir if scale == 1 else make_synthetic_dataset(scale, args.data_dir)
+        for r in run_cases(data_dir, args.sample, args.repeat, args.api_latency):
+            r["scale"] = scale
+            results.append(r)
+            print(f"x{scale:<5} {r['case']:<40} {r['us_per_item']:>12.2f} us/item  ({r['items']} items)")
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Results saved to {args.output}")
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.threshold)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} case(s) regressed by more than {args.threshold}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after ``ttl`` seconds.
+
+    Keeps hit/miss/eviction counters so callers can size it under real traffic.
+    ``ttl=None`` keeps entries until they are evicted by size.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key`` (refreshing its LRU position) or ``default``."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Store ``value`` under ``key``, evicting the least recently used entries if full."""
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for ``key``, calling ``compute()`` and caching it on a miss."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Counters and occupancy, e.g. for a debug panel."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class ResponseCache:
+    """On-disk cache of raw API responses in a single SQLite file.
+
+    Entries are keyed by (endpoint, chain, address, params), expire after a
+    per-endpoint TTL, and the file is kept under ``max_bytes`` by evicting the
+    least recently read entries. Payloads are stored as zlib-compressed JSON.
+    """
+
+    def __init__(self, path, ttls=None, default_ttl=3600, max_bytes=256 * 1024 * 1024):
+        self.path = Path(path)
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, endpoint TEXT, payload BLOB, raw_size INTEGER,"
+            " expires_at REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(endpoint, params):
+        """Stable key for a call: endpoint, chain, normalized address and remaining params."""
+        params = dict(params or {})
+        chain = params.pop("chain", None)
+        address = str(params.pop("address", "")).lower()
+        blob = json.dumps([endpoint, chain, address, params], sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def get(self, endpoint, params):
+        """Cached response for the call, or None if absent or expired."""
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, raw_size, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[2] <= now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            self.bytes_saved += row[1]
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, endpoint, params, response):
+        """Store a response and evict least recently read entries over ``max_bytes``."""
+        raw = json.dumps(response, default=str).encode()
+        payload = zlib.compress(raw)
+        now = time.time()
+        ttl = self.ttls.get(endpoint, self.default_ttl)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (self.make_key(endpoint, params), endpoint, payload, len(raw), now + ttl, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        total = self._conn.execute("SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, LENGTH(payload) FROM responses ORDER BY last_access"
+        ).fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        """Hit rate, bytes saved and occupancy."""
+        with self._lock:
+            entries, stored = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "stored_bytes": stored,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+class ApiWrapper:
+    """Base for wrappers that apply a policy to every call on a ``moralis.evm_api``-shaped object.
+
+    Namespaces (``api.wallets``) come back wrapped the same way, and calling an
+    endpoint runs ``self.call(endpoint, target, *args, **kwargs)`` with its
+    dotted name (``"wallets.get_wallet_stats"``) and the wrapped function.
+    Subclasses override ``call``; wrappers nest, outermost policy first.
+    """
+
+    def __init__(self, api):
+        self._api = api
+        self._path = ()
+
+    def __getattr__(self, name):
+        target = getattr(self._api, name)
+        path = self._path + (name,)
+        if not callable(target):
+            namespace = object.__new__(type(self))
+            namespace.__dict__.update(self.__dict__, _api=target, _path=path)
+            return namespace
+        endpoint = ".".join(path)
+
+        def call(*args, **kwargs):
+            return self.call(endpoint, target, *args, **kwargs)
+
+        return call
+
+    def call(self, endpoint, target, *args, **kwargs):
+        return target(*args, **kwargs)
+
+
+class CachingApi(ApiWrapper):
+    """Wraps a ``moralis.evm_api``-shaped object so its calls go through a ResponseCache.
+
+    ``CachingApi(evm_api, cache).wallets.get_wallet_stats(api_key=..., params=...)``
+    returns the cached response when one is fresh and calls through otherwise.
+    """
+
+    def __init__(self, api, cache):
+        super().__init__(api)
+        self._cache = cache
+
+    def call(self, endpoint, target, api_key=None, params=None, **kwargs):
+        cached = self._cache.get(endpoint, params)
+        if cached is not None:
+            return cached
+        response = target(api_key=api_key, params=params, **kwargs)
+        self._cache.set(endpoint, params, response)
+        return response
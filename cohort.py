@@ -0,0 +1,104 @@
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# Raw feature values that the wallet scores are ranked on.
+COHORT_METRICS = ("activity_score", "total_networth", "total_defi_usd")
+
+KEY_BYTES = 20
+
+
+class CohortSketch:
+    """Sorted values of each scoring metric across a wallet universe.
+
+    ``percentile`` ranks a value against the cohort with two binary searches,
+    so scoring one wallet never touches the tables. Members are tracked by
+    their 20-byte address key; ``add`` inserts only wallets not seen before,
+    keeping each array sorted in place. Missing (NaN) values are not ranked.
+    """
+
+    def __init__(self, values=None, members=(), fingerprint=None):
+        values = values or {}
+        self.values = {m: np.sort(np.asarray(values.get(m, ()), dtype=float)) for m in COHORT_METRICS}
+        for metric, arr in self.values.items():
+            self.values[metric] = arr[~np.isnan(arr)]
+        self.members = set(members)
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, keys, frame, fingerprint=None):
+        """Sketch of the wallets ``keys`` whose metrics are the columns of ``frame``.
+
+        Keys that are not 20-byte addresses are left out of the cohort.
+        """
+        valid = np.array([isinstance(k, bytes) and len(k) == KEY_BYTES for k in keys], dtype=bool)
+        values = {m: np.asarray(frame[m], dtype=float)[valid] for m in COHORT_METRICS}
+        members = (k for k, ok in zip(keys, valid) if ok)
+        return cls(values, members, fingerprint)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, key):
+        return key in self.members
+
+    def add(self, key, metrics):
+        """Insert one wallet's ``metrics`` (a mapping); returns False if it was already ranked."""
+        if not isinstance(key, bytes) or len(key) != KEY_BYTES:
+            return False
+        with self._lock:
+            if key in self.members:
+                return False
+            self.members.add(key)
+            for metric in COHORT_METRICS:
+                value = float(metrics[metric])
+                if np.isnan(value):
+                    continue
+                arr = self.values[metric]
+                self.values[metric] = np.insert(arr, np.searchsorted(arr, value), value)
+        return True
+
+    def percentile(self, metric, value):
+        """Mid-rank of ``value`` within the cohort, in [0, 1]; ties share the middle rank.
+
+        Accepts a scalar or an array; NaN stays NaN.
+        """
+        arr = self.values[metric]
+        if np.ndim(value) == 0:
+            value = float(value)
+            if not len(arr) or value != value:
+                return float("nan")
+            return int(arr.searchsorted(value, "left") + arr.searchsorted(value, "right")) / (2 * len(arr))
+        value = np.asarray(value, dtype=float)
+        if not len(arr):
+            return np.full(value.shape, np.nan)
+        below = arr.searchsorted(value, "left")
+        through = arr.searchsorted(value, "right")
+        return np.where(np.isnan(value), np.nan, (below + through) / (2 * len(arr)))
+
+    def save(self, path):
+        """Write the sketch to ``path`` (an ``.npz`` file), replacing it atomically."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            members = np.frombuffer(b"".join(self.members), dtype=np.uint8).reshape(-1, KEY_BYTES)
+            arrays = dict(self.values)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, members=members, fingerprint=np.array(self.fingerprint or ""), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a sketch written by ``save``; None if it is missing or unreadable."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                values = {m: data[m] for m in COHORT_METRICS}
+                members = [row.tobytes() for row in data["members"]]
+                fingerprint = str(data["fingerprint"]) or None
+        except (OSError, KeyError, ValueError):
+            return None
+        return cls(values, members, fingerprint)
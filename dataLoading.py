@@ -1,184 +1,1317 @@
 import pandas as pd
 import numpy as np
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from enum import IntFlag
 from pathlib import Path
-from moralis import evm_api
+import importlib.util
+import heapq
+import json
+import math
 import os
-from dotenv import load_dotenv
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from caching import ApiWrapper, CachingApi, ResponseCache
+from cohort import COHORT_METRICS, KEY_BYTES, CohortSketch
+from tracing import span, traced
 
-load_dotenv()
+# The Moralis client, python-dotenv and pyarrow are imported on first use, so
+# offline jobs that only read local tables start fast and need no API key.
+_env_loaded = False
 
-MORALIS_API_KEY = os.getenv("MORALIS_API_KEY")
-if not MORALIS_API_KEY:
-    raise ValueError("MORALIS_API_KEY not found in environment variables. Please create a .env file with your API key.")
 
+def load_env():
+    """Load settings from a ``.env`` file into the environment (once; existing variables win)."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
 
-def fetch_wallet_data_from_api(wallet_address):
-    """Fetch wallet data from Moralis API for a single wallet."""
-    try:
-        api_key = MORALIS_API_KEY
-        data = {}
 
-        # Get token balances
-        token_params = {
-            "chain": "eth",
-            "address": wallet_address
-        }
-        token_result = evm_api.wallets.get_wallet_token_balances_price(
-            api_key=api_key,
-            params=token_params,
-        )
-        data["tokens"] = pd.DataFrame(token_result.get("result", []))
-
-        # Get net worth
-        networth_params = {
-            "exclude_spam": True,
-            "exclude_unverified_contracts": True,
-            "max_token_inactivity": 1,
-            "min_pair_side_liquidity_usd": 1000,
-            "address": wallet_address
-        }
-        networth_result = evm_api.wallets.get_wallet_net_worth(
-            api_key=api_key,
-            params=networth_params,
-        )
-        networth_data = []
-        total_usd = networth_result.get("total_networth_usd", 0)
-        for chain_data in networth_result.get("chains", []):
-            networth_data.append({
+def moralis_api():
+    """``moralis.evm_api``, imported on first use."""
+    from moralis import evm_api
+    return evm_api
+
+
+def moralis_api_key(required=True):
+    """The Moralis API key from the environment or a ``.env`` file.
+
+    Raises ValueError if it is ``required`` and not set.
+    """
+    load_env()
+    api_key = os.getenv("MORALIS_API_KEY")
+    if required and not api_key:
+        raise ValueError("MORALIS_API_KEY not found in environment variables. Please create a .env file with your API key.")
+    return api_key
+
+
+# Seconds to wait for the Moralis calls of one wallet before giving up on the stragglers.
+API_TIMEOUT = 15
+
+# Raw Moralis responses are cached on disk; set MORALIS_CACHE_PATH to "" to disable.
+RESPONSE_CACHE_PATH = "data/.cache/moralis_responses.sqlite"
+RESPONSE_CACHE_TTLS = {
+    "wallets.get_wallet_token_balances_price": 10 * 60,
+    "wallets.get_wallet_net_worth": 10 * 60,
+    "wallets.get_wallet_stats": 60 * 60,
+    "nft.get_wallet_nft_collections": 60 * 60,
+}
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The process-wide Moralis ResponseCache, opened on first use (None if disabled).
+
+    The path is ``MORALIS_CACHE_PATH`` if set (also from ``.env``), else ``RESPONSE_CACHE_PATH``.
+    """
+    global _response_cache
+    load_env()
+    path = os.getenv("MORALIS_CACHE_PATH", RESPONSE_CACHE_PATH)
+    if not path:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(path, ttls=RESPONSE_CACHE_TTLS, max_bytes=RESPONSE_CACHE_MAX_BYTES)
+    return _response_cache
+
+
+# Paginated listings (token balances, NFT collections) are read this many
+# entries per request, following the cursor until the last page.
+API_PAGE_SIZE = 100
+# Rows of each paginated listing kept per wallet (the highest valued first);
+# counts over the whole listing go to the summary tables.
+LISTING_ROWS_KEPT = 10
+
+
+def iter_pages(endpoint, api_key, params, page_size=API_PAGE_SIZE):
+    """Yield the ``result`` list of each page of a cursor-paginated Moralis endpoint.
+
+    Only one page is held at a time; the next is requested when the caller
+    asks for it.
+    """
+    cursor = None
+    while True:
+        page_params = {**params, "limit": page_size}
+        if cursor:
+            page_params["cursor"] = cursor
+        response = endpoint(api_key=api_key, params=page_params)
+        result = response.get("result", [])
+        if isinstance(result, dict):
+            result = [result]
+        yield result
+        cursor = response.get("cursor")
+        if not cursor or not result:
+            return
+
+
+class ListingAggregate:
+    """Running summary of a paginated listing, fed one row at a time.
+
+    Tracks the distinct values of ``distinct_key`` and keeps the ``keep``
+    best rows by ``rank_key`` (descending, ties in arrival order, missing
+    values last; arrival order alone without a ``rank_key``). Memory grows
+    with ``keep`` and the number of distinct values, not with the listing.
+    ``keep=None`` keeps every row, in the same order.
+    """
+
+    def __init__(self, distinct_key, rank_key=None, keep=LISTING_ROWS_KEPT):
+        self.distinct_key = distinct_key
+        self.rank_key = rank_key
+        self.keep = keep
+        self.distinct = set()
+        self.rows_seen = 0
+        self._heap = []
+
+    def add(self, row):
+        value = row.get(self.distinct_key)
+        if value is not None:
+            self.distinct.add(value)
+        score = 0.0
+        if self.rank_key is not None:
+            try:
+                score = float(row.get(self.rank_key))
+            except (TypeError, ValueError):
+                score = float("nan")
+        # Min-heap of the best rows: present values beat NaN, then value, then earlier arrival.
+        item = ((score == score, score if score == score else 0.0, -self.rows_seen), row)
+        self.rows_seen += 1
+        if self.keep is None or len(self._heap) < self.keep:
+            heapq.heappush(self._heap, item)
+        elif item[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, item)
+
+    def merge(self, other):
+        """Fold in a listing that came after this one (e.g. the next chain)."""
+        for row in other.rows():
+            self.add(row)
+        self.rows_seen += other.rows_seen - len(other._heap)
+        self.distinct |= other.distinct
+
+    def rows(self):
+        """The kept rows, best first."""
+        return [row for _, row in sorted(self._heap, key=lambda item: item[0], reverse=True)]
+
+    def frame(self):
+        return pd.DataFrame(self.rows())
+
+
+def _fetch_tokens(api, api_key, wallet_address, chain="eth", keep=LISTING_ROWS_KEPT):
+    """Token balances with prices on one chain, streamed page by page into a ListingAggregate.
+
+    ``keep`` is passed to the ListingAggregate; None keeps the whole listing.
+    """
+    token_params = {
+        "chain": chain,
+        "address": wallet_address
+    }
+    listing = ListingAggregate("token_symbol", rank_key="usd_value", keep=keep)
+    for page in iter_pages(api.wallets.get_wallet_token_balances_price, api_key, token_params):
+        for token in page:
+            listing.add({
                 "wallet": wallet_address,
-                "chain": chain_data.get("chain"),
-                "native_balance": chain_data.get("native_balance_formatted"),
-                "native_balance_usd": chain_data.get("native_balance_usd"),
-                "token_balance_usd": chain_data.get("token_balance_usd"),
-                "chain_networth_usd": chain_data.get("networth_usd"),
-                "total_networth_usd": total_usd
+                "chain": chain,
+                "token_address": token.get("token_address"),
+                "token_symbol": token.get("symbol"),
+                "token_name": token.get("name"),
+                "balance": token.get("balance_formatted"),
+                "usd_price": token.get("usd_price"),
+                "usd_value": token.get("usd_value"),
+                "native_token": token.get("native_token"),
+                "verified_contract": token.get("verified_contract"),
+                "portfolio_pct": token.get("portfolio_percentage"),
             })
-        data["networth"] = pd.DataFrame(networth_data)
+    return listing
 
-        # Get wallet stats
-        stats_params = {
-            "chain": "eth",
-            "address": wallet_address
-        }
-        stats_result = evm_api.wallets.get_wallet_stats(
-            api_key=api_key,
-            params=stats_params,
-        )
-        stats_data = [{
+
+def _fetch_networth(api, api_key, wallet_address, chains=None):
+    """Net worth over ``chains`` (Moralis' default set if None), one row per chain."""
+    networth_params = {
+        "exclude_spam": True,
+        "exclude_unverified_contracts": True,
+        "max_token_inactivity": 1,
+        "min_pair_side_liquidity_usd": 1000,
+        "address": wallet_address
+    }
+    if chains:
+        networth_params["chains"] = list(chains)
+    networth_result = api.wallets.get_wallet_net_worth(
+        api_key=api_key,
+        params=networth_params,
+    )
+    networth_data = []
+    total_usd = networth_result.get("total_networth_usd", 0)
+    for chain_data in networth_result.get("chains", []):
+        networth_data.append({
             "wallet": wallet_address,
-            "nfts": stats_result.get("nfts", ""),
-            "collections": stats_result.get("collections", ""),
-            "transactions_total": stats_result.get("transactions", {}).get("total", ""),
-            "nft_transfers_total": stats_result.get("nft_transfers", {}).get("total", ""),
-            "token_transfers_total": stats_result.get("token_transfers", {}).get("total", ""),
-        }]
-        data["stats"] = pd.DataFrame(stats_data)
-
-        # Get NFT collections
-        nft_params = {
-            "chain": "eth",
-            "address": wallet_address
-        }
-        nft_result = evm_api.nft.get_wallet_nft_collections(
-            api_key=api_key,
-            params=nft_params
-        )
-        collections = nft_result.get("result", [])
-        if isinstance(collections, dict):
-            collections = [collections]
-        nft_data = []
-        for col in collections:
-            nft_data.append({
+            "chain": chain_data.get("chain"),
+            "native_balance": chain_data.get("native_balance_formatted"),
+            "native_balance_usd": chain_data.get("native_balance_usd"),
+            "token_balance_usd": chain_data.get("token_balance_usd"),
+            "chain_networth_usd": chain_data.get("networth_usd"),
+            "total_networth_usd": total_usd
+        })
+    return pd.DataFrame(networth_data)
+
+
+def _fetch_stats(api, api_key, wallet_address, chain="eth"):
+    """Wallet activity stats on one chain."""
+    stats_params = {
+        "chain": chain,
+        "address": wallet_address
+    }
+    stats_result = api.wallets.get_wallet_stats(
+        api_key=api_key,
+        params=stats_params,
+    )
+    stats_data = [{
+        "wallet": wallet_address,
+        "chain": chain,
+        "nfts": stats_result.get("nfts", ""),
+        "collections": stats_result.get("collections", ""),
+        "transactions_total": stats_result.get("transactions", {}).get("total", ""),
+        "nft_transfers_total": stats_result.get("nft_transfers", {}).get("total", ""),
+        "token_transfers_total": stats_result.get("token_transfers", {}).get("total", ""),
+    }]
+    return pd.DataFrame(stats_data)
+
+
+def _fetch_nfts(api, api_key, wallet_address, chain="eth", keep=LISTING_ROWS_KEPT):
+    """NFT collections held on one chain, streamed page by page into a ListingAggregate.
+
+    ``keep`` is passed to the ListingAggregate; None keeps the whole listing.
+    """
+    nft_params = {
+        "chain": chain,
+        "address": wallet_address
+    }
+    listing = ListingAggregate("token_address", keep=keep)
+    for page in iter_pages(api.nft.get_wallet_nft_collections, api_key, nft_params):
+        for col in page:
+            listing.add({
                 "wallet_address": wallet_address,
+                "chain": chain,
                 "token_address": col.get("token_address", ""),
                 "contract_type": col.get("contract_type", ""),
                 "name": col.get("name", ""),
                 "verified_collection": col.get("verified_collection", ""),
                 "count": col.get("count", 0)
             })
-        data["nfts"] = pd.DataFrame(nft_data)
+    return listing
+
+
+# One independent Moralis call per table, keyed by the table it fills. Each is
+# called as fetch(api, api_key, wallet_address, chain) (see api_calls) and
+# returns a DataFrame, or a ListingAggregate for the paginated listings.
+API_FETCHERS = {
+    "tokens": _fetch_tokens,
+    "networth": _fetch_networth,
+    "stats": _fetch_stats,
+    "nfts": _fetch_nfts,
+}
+
+# Endpoint behind each table, as named in RESPONSE_CACHE_TTLS.
+API_ENDPOINTS = {
+    "tokens": "wallets.get_wallet_token_balances_price",
+    "networth": "wallets.get_wallet_net_worth",
+    "stats": "wallets.get_wallet_stats",
+    "nfts": "nft.get_wallet_nft_collections",
+}
+
+# Tables fetched with one call per chain; net worth covers every chain in one call.
+PER_CHAIN_TABLES = ("tokens", "stats", "nfts")
+
+# Summary table of each paginated listing, with the counts its kept rows cannot
+# give: (table name, count column, listing rows column).
+LISTING_SUMMARIES = {
+    "tokens": ("token_summary", "token_count", "tokens_seen"),
+    "nfts": ("nft_summary", "unique_nft_collections", "collections_seen"),
+}
+
+# Chains queried for wallets fetched live. MORALIS_CHAINS (comma-separated
+# Moralis chain names) overrides the list.
+DEFAULT_CHAINS = ("eth", "polygon", "bsc", "arbitrum", "base", "optimism")
+
+# Compute units charged per call to each endpoint. These are estimates; set
+# them to your Moralis plan's price list so the rate limiter stays under quota.
+API_COSTS = {
+    "tokens": 100,
+    "networth": 500,
+    "stats": 50,
+    "nfts": 50,
+}
+
+
+def api_chains():
+    """Chains queried per wallet: ``MORALIS_CHAINS`` if set (also from ``.env``), else ``DEFAULT_CHAINS``."""
+    load_env()
+    chains = [c.strip() for c in os.getenv("MORALIS_CHAINS", "").split(",") if c.strip()]
+    return tuple(chains) or DEFAULT_CHAINS
+
+
+def api_calls(chains):
+    """The Moralis calls for one wallet, as ``(table, chain)`` pairs.
+
+    Net worth is one call whose ``chain`` is the whole tuple of chains; the
+    other tables take one call per chain.
+    """
+    chains = tuple(chains)
+    return [("networth", chains)] + [(name, chain) for name in PER_CHAIN_TABLES for chain in chains]
+
+
+def merge_chain_results(wallet_address, results):
+    """Combine per-call results ``{(table, chain): df}`` into one frame per table.
+
+    Paginated listings (``ListingAggregate``) are merged across chains: their
+    table gets the best ``keep`` rows overall (every row if None), and the matching
+    ``LISTING_SUMMARIES`` table the exact counts over every row.
+
+    Also derives the ``active_chains`` table: a chain is active if the wallet
+    holds tokens or NFTs there, has transactions there, or has non-zero net
+    worth on it. Chains keep the order they were queried in.
+    """
+    frames, listings, per_call = {}, {}, {}
+    for (name, chain), result in results.items():
+        if isinstance(result, ListingAggregate):
+            merged = listings.setdefault(name, ListingAggregate(result.distinct_key, result.rank_key, result.keep))
+            merged.merge(result)
+            result = result.frame()
+        per_call[name, chain] = result
+        frames.setdefault(name, []).append(result)
+    tables = {}
+    for name, dfs in frames.items():
+        dfs = [df for df in dfs if df is not None and not df.empty]
+        tables[name] = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+    for name, listing in listings.items():
+        tables[name] = listing.frame()
+        summary, count_column, seen_column = LISTING_SUMMARIES[name]
+        if listing.rows_seen:
+            tables[summary] = pd.DataFrame({"wallet": [wallet_address], count_column: [len(listing.distinct)],
+                                            seen_column: [listing.rows_seen]})
+
+    queried, active = [], set()
+    for (name, chain), df in per_call.items():
+        if name not in PER_CHAIN_TABLES:
+            continue
+        if chain not in queried:
+            queried.append(chain)
+        if df is None or df.empty:
+            continue
+        if name != "stats" or pd.to_numeric(df["transactions_total"], errors="coerce").fillna(0).sum() > 0:
+            active.add(chain)
+    networth = tables.get("networth", _EMPTY_FRAME)
+    if "chain" in networth.columns and "chain_networth_usd" in networth.columns:
+        worth = pd.to_numeric(networth["chain_networth_usd"], errors="coerce").fillna(0)
+        active.update(networth.loc[worth > 0, "chain"])
+    active = [c for c in queried if c in active] + sorted(c for c in active if c not in queried)
+    tables["active_chains"] = pd.DataFrame({"wallet": [wallet_address] * len(active), "chain": active})
+    return tables
+
+
+class TokenBucket:
+    """Thread-safe token-bucket rate limiter.
+
+    Refills at ``rate`` units per second up to ``capacity``; ``acquire(cost)``
+    blocks until ``cost`` units are available. Used to keep Moralis compute-unit
+    spend under the plan's per-second quota across concurrent workers.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        cost = min(float(cost), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return
+                wait = (cost - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedApi(ApiWrapper):
+    """Wraps a ``moralis.evm_api``-shaped object so each call first takes its cost from a TokenBucket.
+
+    ``costs`` maps endpoint names (``"wallets.get_wallet_stats"``) to compute
+    units; unknown endpoints cost 1. Wrapped inside a ``CachingApi``, cache
+    hits cost nothing.
+    """
 
-        return data
+    def __init__(self, api, limiter, costs):
+        super().__init__(api)
+        self._limiter = limiter
+        self._costs = costs
 
-    except Exception as e:
-        print(f"Error fetching data from Moralis API: {e}")
+    def call(self, endpoint, target, *args, **kwargs):
+        self._limiter.acquire(self._costs.get(endpoint, 1))
+        return target(*args, **kwargs)
+
+
+# Compute units per second shared by every live fetch in the process.
+API_CU_PER_SECOND = 1000
+
+_api_limiter = None
+_api_limiter_lock = threading.Lock()
+
+
+def api_cu_per_second():
+    """Compute units per second for live fetches (``MORALIS_CU_PER_SECOND`` overrides the default)."""
+    load_env()
+    return float(os.getenv("MORALIS_CU_PER_SECOND", API_CU_PER_SECOND))
+
+
+def get_api_limiter():
+    """The process-wide TokenBucket for live fetches, at ``api_cu_per_second()``."""
+    global _api_limiter
+    with _api_limiter_lock:
+        if _api_limiter is None:
+            _api_limiter = TokenBucket(api_cu_per_second())
+    return _api_limiter
+
+
+def set_api_limiter(limiter):
+    """Replace the process-wide TokenBucket, e.g. with one worker process's share of the budget."""
+    global _api_limiter
+    with _api_limiter_lock:
+        _api_limiter = limiter
+
+
+@traced("moralis_fetch")
+def fetch_wallet_data_from_api(wallet_address, api=None, timeout=API_TIMEOUT, use_cache=True,
+                               chains=None, limiter=None):
+    """Fetch wallet data from Moralis API for a single wallet.
+
+    Every endpoint and chain (``chains``, default ``api_chains()``) is an
+    independent call, so they all run concurrently and the wallet costs
+    roughly the slowest call instead of the sum. Calls that miss the response
+    cache first take their compute units from ``limiter`` (default the shared
+    ``get_api_limiter()``). Everything must finish within ``timeout`` seconds;
+    a call that fails or times out contributes no rows, and None is returned
+    only if every call failed. Per-chain results are merged into the usual
+    tables (with a ``chain`` column) plus ``active_chains``.
+
+    ``api`` defaults to ``moralis.evm_api`` (which needs ``MORALIS_API_KEY``)
+    and may be any object exposing the same ``wallets``/``nft`` functions
+    (e.g. an offline stub). With ``use_cache``, responses are served from and
+    stored in the on-disk ``get_response_cache()`` so repeat lookups within
+    the TTL stay local.
+    """
+    api_key = moralis_api_key(required=api is None)
+    api = RateLimitedApi(api or moralis_api(), limiter or get_api_limiter(),
+                         {API_ENDPOINTS[name]: cost for name, cost in API_COSTS.items()})
+    # Lowercase before calling so the fetched rows carry the same key as the loaded tables.
+    wallet_address = normalize_address(wallet_address)
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        api = CachingApi(api, cache)
+    calls = api_calls(chains or api_chains())
+    results = {}
+    failed = []
+    executor = ThreadPoolExecutor(max_workers=len(calls), thread_name_prefix="moralis")
+    try:
+        futures = {
+            (name, chain): executor.submit(traced(f"moralis.{name}")(API_FETCHERS[name]),
+                                           api, api_key, wallet_address, chain)
+            for name, chain in calls
+        }
+        deadline = time.monotonic() + timeout
+        for (name, chain), future in futures.items():
+            label = name if name == "networth" else f"{name} ({chain})"
+            try:
+                results[name, chain] = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except FuturesTimeoutError:
+                print(f"Moralis {label} request timed out after {timeout}s")
+                failed.append((name, chain))
+            except Exception as e:
+                print(f"Error fetching {label} from Moralis API: {e}")
+                failed.append((name, chain))
+    finally:
+        # Don't block on calls that are past the deadline.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if len(failed) == len(calls):
         return None
+    return merge_chain_results(wallet_address, {call: results.get(call) for call in calls})
 
-def load_wallet_data(data_dir="data"):
-    """Load and combine wallet data from CSV files."""
+
+# Columns that identify the owning wallet of a row, in lookup order.
+WALLET_KEY_COLUMNS = ("wallet", "address", "wallet_address")
+
+_NO_ROWS = np.array([], dtype=np.intp)
+_EMPTY_FRAME = pd.DataFrame()
+
+# Columnar cache written next to the CSVs by load_wallet_data.
+CACHE_DIR_NAME = ".cache"
+CACHE_FORMAT_VERSION = "1"
+
+
+def _typed_frame(df):
+    """Fix dtypes once: wallet columns as categoricals, numerics as 64-bit."""
+    for column in df.columns:
+        if column in WALLET_KEY_COLUMNS or column == "wallet_ID":
+            df[column] = df[column].astype("category")
+        elif pd.api.types.is_bool_dtype(df[column]):
+            continue
+        elif pd.api.types.is_integer_dtype(df[column]):
+            df[column] = df[column].astype("int64")
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype("float64")
+    return df
+
+
+def _source_signature(path):
+    """Cache validity key for a source CSV: its mtime and size."""
+    stat = path.stat()
+    return {"version": CACHE_FORMAT_VERSION, "mtime_ns": str(stat.st_mtime_ns), "size": str(stat.st_size)}
+
+
+def _has_pyarrow():
+    """True if pyarrow is installed; the columnar cache is optional and falls back to plain CSV reads."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _read_cached_csv(path):
+    """Read ``path`` through its Feather cache, rebuilding it if the CSV changed.
+
+    The cache is an uncompressed Feather (Arrow IPC) file whose schema metadata
+    records the source CSV's mtime and size. A matching cache is memory-mapped,
+    so repeat loads skip CSV parsing and type inference entirely.
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    cache_path = path.parent / CACHE_DIR_NAME / (path.stem + ".feather")
+    signature = _source_signature(path)
+    if cache_path.exists():
+        try:
+            table = feather.read_table(cache_path, memory_map=True)
+            metadata = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+            if all(metadata.get(k) == v for k, v in signature.items()):
+                return table.to_pandas(split_blocks=True)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable cache {cache_path}: {e}")
+
+    df = _typed_frame(pd.read_csv(path))
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **signature})
+        cache_path.parent.mkdir(exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, cache_path)
+    except (OSError, pa.ArrowException) as e:
+        # The cache is optional: a frame Arrow cannot convert (e.g. a column
+        # pandas read as mixed ints and strings) is returned uncached.
+        print(f"Could not write cache {cache_path}: {e}")
+    return df
+
+
+# Source files read by load_wallet_data, keyed by table name.
+DATA_FILES = {
+    "networth": "wallet_networth_all_chains.csv",
+    "tokens": "token_balances.csv",
+    "defi": "defi_positions.csv",
+    "nfts": "nft_collections_cleaned.csv",
+    "stats": "wallet_stats.csv",
+    "active_chains": "wallet_active_chains.csv",
+    "token_summary": "wallet_token_summary.csv",
+    "nft_summary": "wallet_nft_summary.csv",
+    "wallets": "wallets.csv",
+}
+
+
+def data_fingerprint(data_dir="data"):
+    """Cheap identity of a data directory: the name, mtime and size of each source and delta file.
+
+    Changes whenever any table would load differently, so it can key caches of
+    loaded data without reading the files.
+    """
     base_path = Path(data_dir)
+    parts = [str(base_path.resolve())]
+    for directory in (base_path, base_path / DELTA_DIR_NAME):
+        for filename in DATA_FILES.values():
+            path = directory / filename
+            if path.exists():
+                stat = path.stat()
+                parts.append(f"{path.relative_to(base_path)}:{stat.st_mtime_ns}:{stat.st_size}")
+    return "|".join(parts)
+
+
+# Rows fetched from the API are appended here (one CSV per table) until compacted.
+DELTA_DIR_NAME = ".delta"
+COMPACT_AFTER_ROWS = 5000
+
+# Percentile sketch of the scoring metrics, kept in the columnar cache directory.
+COHORT_FILE_NAME = "cohort_sketch.npz"
+
+# Indexed SQLite copy of the tables (see ``build_wallet_db``), also kept in the cache directory.
+WALLET_DB_FILE_NAME = "wallets.sqlite"
+WALLET_DB_FORMAT_VERSION = "1"
+
+# Wallet stats columns and the features they are summed into.
+STATS_COLUMNS = {"transactions_total": "transactions_total", "nft_transfers_total": "nft_transfers_total",
+                 "token_transfers_total": "token_transfers_total", "nfts": "nft_count",
+                 "collections": "nft_collections"}
+
+# Per-wallet summary tables and the feature columns whose latest row overrides the listing.
+SUMMARY_COLUMNS = {"token_summary": ("token_count",), "nft_summary": ("unique_nft_collections",),
+                   "defi_summary": ("defi_protocols", "total_defi_usd")}
+
+
+def append_csv(path, df):
+    """Append ``df`` to the CSV at ``path``, writing a header if the file is new.
+
+    Rows are aligned to the file's header; if ``df`` brings columns the file
+    lacks (e.g. ``wallet_address`` or ``chain``), the file is rewritten with
+    the wider schema instead of dropping them.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists() and path.stat().st_size > 0:
+        header = pd.read_csv(path, nrows=0).columns.tolist()
+        if set(df.columns) <= set(header):
+            df.reindex(columns=header).to_csv(path, mode="a", header=False, index=False)
+            return
+        merged = pd.concat([_read_csv_or_empty(path), df], ignore_index=True)
+        tmp_path = path.with_suffix(".tmp")
+        merged.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    else:
+        df.to_csv(path, index=False)
+
+
+def _delta_wallets(data_dir):
+    """Normalized wallets with rows under ``<data_dir>/.delta``.
+
+    A wallet's delta rows are its latest fetch, so they replace every base row
+    of that wallet, in whichever tables it appears.
+    """
+    wallets = set()
+    for filename in DATA_FILES.values():
+        path = Path(data_dir) / DELTA_DIR_NAME / filename
+        if path.exists() and path.stat().st_size > 0:
+            df = pd.read_csv(path, usecols=lambda c: c in WALLET_KEY_COLUMNS, dtype=str)
+            for column in df.columns:
+                wallets.update(df[column].dropna().str.strip().str.lower())
+    return wallets
+
+
+def _drop_wallets(df, wallets):
+    """``df`` without the rows owned by any of ``wallets`` (normalized addresses)."""
+    if not wallets or df.empty:
+        return df
+    superseded = np.zeros(len(df), dtype=bool)
+    for column in WALLET_KEY_COLUMNS:
+        if column in df.columns:
+            superseded |= df[column].astype(str).str.strip().str.lower().isin(wallets).to_numpy()
+    return df[~superseded].reset_index(drop=True) if superseded.any() else df
+
+
+def _read_csv_or_empty(path):
+    try:
+        return pd.read_csv(path)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+
+@traced("load_wallet_data")
+def load_wallet_data(data_dir="data", use_cache=True, memory_budget_mb=None):
+    """Load and combine wallet data from CSV files.
+
+    With ``use_cache`` (and pyarrow installed) each CSV is read through a typed
+    Feather copy under ``<data_dir>/.cache`` that is rebuilt only when the CSV's
+    mtime or size changes. Rows persisted under ``<data_dir>/.delta`` (by
+    ``WalletStore.upsert`` or a backfill) are appended to their tables and
+    replace the base rows of the same wallets. Wallet columns are normalized
+    to lowercase so they match ``normalize_address`` queries.
 
-    def safe_load(filename):
+    With ``memory_budget_mb``, the token, NFT and DeFi CSVs are never loaded
+    whole: ``aggregate_listing_csv`` streams them within that budget into the
+    top token rows per wallet plus per-wallet summary tables, which yield the
+    same features.
+    """
+    base_path = Path(data_dir)
+    refreshed = _delta_wallets(base_path)
+
+    def safe_load(filename, aggregate=False):
         path = base_path / filename
-        if path.exists():
+        df = pd.DataFrame()
+        if aggregate and path.exists():
+            df = aggregated[filename]
+        elif path.exists():
             try:
-                df = pd.read_csv(path)
-                return df.fillna(np.nan)
+                if use_cache and _has_pyarrow():
+                    df = _read_cached_csv(path)
+                else:
+                    df = pd.read_csv(path)
             except pd.errors.EmptyDataError:
-                return pd.DataFrame()
-        return pd.DataFrame()
+                pass
+        df = _drop_wallets(df, refreshed)
+        delta_path = base_path / DELTA_DIR_NAME / filename
+        if delta_path.exists():
+            delta = _read_csv_or_empty(delta_path)
+            if not delta.empty:
+                df = delta if df.empty else pd.concat([df, delta], ignore_index=True)
+        return _normalize_wallet_columns(df)
+
+    # Reduced listing tables (keyed by file name) and their summaries (keyed by table name).
+    aggregated, summaries = {}, {}
+    if memory_budget_mb:
+        for name, spec in AGGREGATED_TABLES.items():
+            path = base_path / DATA_FILES[name]
+            wallet_column, columns, _ = spec
+            # Without these columns the table gives no per-wallet features, and is loaded as is.
+            if not path.exists() or path.stat().st_size == 0 or not {wallet_column, *columns} <= set(
+                    pd.read_csv(path, nrows=0).columns):
+                continue
+            tables = aggregate_listing_csv(path, spec, memory_budget_mb * 2**20)
+            aggregated[DATA_FILES[name]] = tables.pop(name)
+            summaries.update(tables)
+
+    data = {name: safe_load(filename, filename in aggregated) for name, filename in DATA_FILES.items()}
+    for name, summary in summaries.items():
+        # Summary rows persisted for fetched wallets come later, so they win.
+        summary = _drop_wallets(summary, refreshed)
+        data[name] = _normalize_wallet_columns(pd.concat([summary, data.get(name, _EMPTY_FRAME)], ignore_index=True))
 
-    data = {
-        "networth": safe_load("wallet_networth_all_chains.csv"),
-        "tokens": safe_load("token_balances.csv"),
-        "defi": safe_load("defi_positions.csv"),
-        "nfts": safe_load("nft_collections_cleaned.csv"),
-        "stats": safe_load("wallet_stats.csv"),
-        "active_chains": safe_load("wallet_active_chains.csv"),
-        "wallets": safe_load("wallets.csv")
-    }
-    
     return data
 
+
+# Rows sampled to estimate the in-memory size of a table's rows.
+PLAN_SAMPLE_ROWS = 10_000
+# Working copies (sorts, groupbys) a partition may need on top of its own size.
+PARTITION_HEADROOM = 4
+
+
+def _plan_partitions(path, usecols, memory_budget):
+    """(rows per chunk, partitions) so a chunk, or one partition with headroom, fits ``memory_budget`` bytes."""
+    sample = pd.read_csv(path, usecols=usecols, nrows=PLAN_SAMPLE_ROWS)
+    if sample.empty:
+        return PLAN_SAMPLE_ROWS, 1
+    row_bytes = sample.memory_usage(index=False, deep=True).sum() / len(sample)
+    with open(path, "rb") as f:
+        head = f.read(1 << 20)
+    estimated_rows = path.stat().st_size / (len(head) / max(head.count(b"\n"), 1))
+    chunk_rows = max(int(memory_budget / (PARTITION_HEADROOM * row_bytes)), 1000)
+    partitions = max(1, math.ceil(estimated_rows * row_bytes * PARTITION_HEADROOM / memory_budget))
+    return chunk_rows, partitions
+
+
+def _iter_partitions(path, wallet_column, usecols, memory_budget, spill_dir=None):
+    """Yield frames that each hold every row of a disjoint set of wallets.
+
+    The CSV is read in chunks; when it does not fit the budget, each chunk
+    is split by a hash of the normalized wallet and appended to one pickle
+    stream per partition under a temporary ``spill_dir``, and partitions are
+    read back one at a time. Rows carry their file position in ``_row``.
+    """
+    chunk_rows, partitions = _plan_partitions(path, usecols, memory_budget)
+    dtypes = {c: str for c in usecols if c != "usd_value"}
+
+    def chunks():
+        offset = 0
+        for chunk in pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=chunk_rows):
+            chunk["_row"] = np.arange(offset, offset + len(chunk))
+            offset += len(chunk)
+            chunk[wallet_column] = chunk[wallet_column].str.strip().str.lower()
+            if "usd_value" in chunk.columns:
+                chunk["usd_value"] = pd.to_numeric(chunk["usd_value"], errors="coerce")
+            yield chunk.dropna(subset=[wallet_column])
+
+    if partitions == 1:
+        frames = list(chunks())
+        yield pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=[*usecols, "_row"])
+        return
+
+    with tempfile.TemporaryDirectory(prefix="wallet-agg-", dir=spill_dir) as tmp:
+        paths = [Path(tmp) / f"part-{i}.pkl" for i in range(partitions)]
+        files = [open(p, "wb") for p in paths]
+        try:
+            for chunk in chunks():
+                part = pd.util.hash_pandas_object(chunk[wallet_column], index=False).to_numpy() % partitions
+                for i, piece in chunk.groupby(part, sort=False):
+                    pickle.dump(piece, files[i], protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            for f in files:
+                f.close()
+        for p in paths:
+            pieces = []
+            with open(p, "rb") as f:
+                while True:
+                    try:
+                        pieces.append(pickle.load(f))
+                    except EOFError:
+                        break
+            p.unlink()
+            if pieces:
+                yield pd.concat(pieces).sort_values("_row", kind="mergesort", ignore_index=True)
+
+
+def _reduce_tokens(part, wallet_column):
+    """Top ``LISTING_ROWS_KEPT`` token rows per wallet and the ``token_summary`` counts."""
+    grouped = part.groupby(wallet_column, sort=False)
+    summary = pd.DataFrame({"token_count": grouped["token_symbol"].nunique(), "tokens_seen": grouped.size()})
+    ranked = part.sort_values([wallet_column, "usd_value"], ascending=[True, False],
+                              kind="mergesort", na_position="last")
+    kept = ranked.groupby(wallet_column, sort=False).head(LISTING_ROWS_KEPT)
+    return {"tokens": kept.drop(columns="_row"), "token_summary": summary.rename_axis("wallet").reset_index()}
+
+
+def _reduce_nfts(part, wallet_column):
+    """The ``nft_summary`` counts; no NFT rows are kept."""
+    grouped = part.groupby(wallet_column, sort=False)
+    summary = pd.DataFrame({"unique_nft_collections": grouped["token_address"].nunique(),
+                            "collections_seen": grouped.size()})
+    return {"nfts": part.iloc[:0].drop(columns="_row"), "nft_summary": summary.rename_axis("wallet").reset_index()}
+
+
+def _reduce_defi(part, wallet_column):
+    """The ``defi_summary`` protocol count and USD total; no DeFi rows are kept."""
+    grouped = part.groupby(wallet_column, sort=False)
+    summary = pd.DataFrame({"defi_protocols": grouped["protocol_name"].nunique(),
+                            "total_defi_usd": grouped["usd_value"].sum(), "positions_seen": grouped.size()})
+    return {"defi": part.iloc[:0].drop(columns="_row"), "defi_summary": summary.rename_axis("wallet").reset_index()}
+
+
+# Listing tables that load_wallet_data can aggregate out of core: the wallet
+# column, the other columns read, and the per-wallet reduction.
+AGGREGATED_TABLES = {
+    "tokens": ("wallet", ("token_symbol", "usd_value"), _reduce_tokens),
+    "nfts": ("wallet_address", ("token_address",), _reduce_nfts),
+    "defi": ("wallet", ("protocol_name", "usd_value"), _reduce_defi),
+}
+
+
+def aggregate_listing_csv(path, spec, memory_budget, spill_dir=None):
+    """Reduce one listing CSV per wallet without loading it whole.
+
+    ``spec`` is an ``AGGREGATED_TABLES`` entry. Peak memory follows
+    ``memory_budget`` (bytes) rather than the file size: rows are streamed in
+    chunks and, for files over budget, hash-partitioned by wallet on disk so
+    each partition is reduced on its own. Returns the reduced tables.
+    """
+    wallet_column, columns, reduce = spec
+    results = {}
+    with span("aggregate_listing_csv"):
+        for part in _iter_partitions(Path(path), wallet_column, [wallet_column, *columns], memory_budget, spill_dir):
+            for name, df in reduce(part, wallet_column).items():
+                results.setdefault(name, []).append(df)
+    return {name: pd.concat(dfs, ignore_index=True) for name, dfs in results.items()}
+
+
+def read_wallet_list(path):
+    """Wallet addresses from a CSV (``wallet_ID``/``wallet``/``address`` or first column).
+
+    Any other file (e.g. ``.txt``) is read as one address per line.
+    """
+    if Path(path).suffix.lower() != ".csv":
+        lines = (line.strip() for line in Path(path).read_text().splitlines())
+        return list(dict.fromkeys(line for line in lines if line and not line.startswith("#")))
+    df = pd.read_csv(path)
+    column = next((c for c in ("wallet_ID", "wallet", "address") if c in df.columns), df.columns[0])
+    return df[column].dropna().astype(str).str.strip().drop_duplicates().tolist()
+
+
+def compact_deltas(data_dir="data"):
+    """Fold the ``.delta`` rows into the base CSVs and remove the delta files.
+
+    Delta rows are appended to their base file (widening its schema if they
+    bring new columns). Base files holding rows of a wallet that has delta
+    rows are rewritten without them, so a refreshed wallet keeps only its
+    latest fetch. Returns the number of rows compacted.
+    """
+    base_path = Path(data_dir)
+    refreshed = _delta_wallets(base_path)
+    compacted = 0
+    for filename in DATA_FILES.values():
+        delta_path = base_path / DELTA_DIR_NAME / filename
+        path = base_path / filename
+        delta = _read_csv_or_empty(delta_path) if delta_path.exists() else _EMPTY_FRAME
+        if refreshed and _has_wallet_rows(path, refreshed):
+            merged = pd.concat([_drop_wallets(_read_csv_or_empty(path), refreshed), delta], ignore_index=True)
+            tmp_path = path.with_suffix(".tmp")
+            merged.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        elif not delta.empty:
+            append_csv(path, delta)
+        compacted += len(delta)
+        if delta_path.exists():
+            delta_path.unlink()
+    return compacted
+
+
+def _has_wallet_rows(path, wallets):
+    """True if the CSV at ``path`` has rows owned by any of ``wallets`` (reads only its wallet columns)."""
+    if not path.exists() or path.stat().st_size == 0:
+        return False
+    owners = pd.read_csv(path, usecols=lambda c: c in WALLET_KEY_COLUMNS, dtype=str)
+    return len(_drop_wallets(owners, wallets)) < len(owners)
+
+
+def normalize_address(wallet_address):
+    """Return the canonical lookup key for a wallet address."""
+    return str(wallet_address).strip().lower()
+
+
+def address_key(wallet_address):
+    """Compact lookup key for a wallet: its 20 address bytes.
+
+    Input is normalized first, so checksummed and lowercase spellings share a
+    key. Anything that is not a 0x-prefixed 40-hex-digit address keeps its
+    normalized string as the key.
+    """
+    normalized = normalize_address(wallet_address)
+    if len(normalized) == 42 and normalized.startswith("0x"):
+        try:
+            return bytes.fromhex(normalized[2:])
+        except ValueError:
+            pass
+    return normalized
+
+
+def _address_keys(series):
+    """Vectorized ``address_key`` over a wallet column (None for missing values).
+
+    Each distinct address is converted once and expanded through the
+    categorical (or factorized) codes.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series)
+    keys = np.array([address_key(u) for u in uniques] + [None], dtype=object)
+    return pd.Series(keys[codes], index=series.index)
+
+
+def _normalize_wallet_columns(df):
+    """Lowercase and strip every wallet column of ``df``, stored as a categorical."""
+    for column in df.columns:
+        if column not in WALLET_KEY_COLUMNS and column != "wallet_ID":
+            continue
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories = values.cat.categories.astype(str).str.strip().str.lower()
+            if categories.is_unique:
+                df[column] = values.cat.rename_categories(categories)
+                continue
+        df[column] = values.astype(str).str.strip().str.lower().where(values.notna()).astype("category")
+    return df
+
+
+def _table_index(df):
+    """``(column, {address key: row positions})`` for a table, or None if it has no wallet column."""
+    column = next((c for c in WALLET_KEY_COLUMNS if c in df.columns), None)
+    if df.empty or column is None:
+        return None
+    keys = _address_keys(df[column])
+    return column, keys.groupby(keys, sort=False).indices
+
+
+class WalletStore(Mapping):
+    """Wallet tables with a prebuilt per-wallet row index.
+
+    A drop-in for the ``data_dict`` returned by ``load_wallet_data``: it maps
+    table names to DataFrames, but also groups every table by the 20-byte
+    ``address_key`` of its wallet column once, so existence checks and
+    per-wallet slices are dict lookups instead of full-table scans, whatever
+    the casing of the queried address.
+
+    Wallets fetched from the API can be merged in with ``upsert`` so later
+    lookups hit locally. With ``data_dir`` and ``persist`` set, upserted rows
+    are also appended to ``<data_dir>/.delta`` and folded into the base CSVs
+    by ``compact_deltas`` once ``COMPACT_AFTER_ROWS`` have accumulated.
+
+    ``cohort`` ranks wallets against every wallet in the store; upserted
+    wallets are added to it as they arrive.
+    """
+
+    def __init__(self, data_dict, data_dir=None, persist=False, cohort=None):
+        self.tables = dict(data_dict)
+        self.data_dir = Path(data_dir) if data_dir is not None else None
+        self.persist = persist and data_dir is not None
+        self._index = {}
+        self._arrays = {}
+        self._lock = threading.Lock()
+        self._cohort = cohort
+        self._cohort_lock = threading.Lock()
+        self._pending_delta_rows = 0
+        with span("build_wallet_index"):
+            for name in self.tables:
+                self._index_table(name)
+
+    def _index_table(self, name):
+        entry = _table_index(self.tables[name])
+        if entry is not None:
+            self._index[name] = entry
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def __iter__(self):
+        return iter(self.tables)
+
+    def __len__(self):
+        return len(self.tables)
+
+    def has_wallet(self, wallet_address):
+        """True if any indexed table has rows for ``wallet_address``."""
+        key = address_key(wallet_address)
+        return any(key in groups for _, groups in self._index.values())
+
+    def wallet_positions(self, name, wallet_address):
+        """Row positions of ``wallet_address`` in table ``name`` (possibly empty)."""
+        entry = self._index.get(name)
+        if entry is None:
+            return _NO_ROWS
+        return entry[1].get(address_key(wallet_address), _NO_ROWS)
+
+    def column_values(self, name, column):
+        """NumPy values of one column, cached with the table they came from (None if missing).
+
+        Readers take no lock, so an entry cached from a table ``upsert`` has
+        since replaced is rebuilt rather than returned.
+        """
+        df = self.tables.get(name, _EMPTY_FRAME)
+        cached = self._arrays.get((name, column))
+        if cached is not None and cached[0] is df:
+            return cached[1]
+        if column not in df.columns:
+            return None
+        values = df[column].to_numpy()
+        self._arrays[(name, column)] = (df, values)
+        return values
+
+    def wallet_keys(self):
+        """Address keys of every wallet with rows in any indexed table."""
+        keys = set()
+        for _, groups in self._index.values():
+            keys.update(groups)
+        return keys
+
+    @property
+    def cohort(self):
+        """``CohortSketch`` of the scoring metrics over every wallet in the store.
+
+        Built on first use with one batch pass. A store loaded from a data
+        directory persists it under ``<data_dir>/.cache`` and reuses it while
+        ``data_fingerprint`` is unchanged.
+        """
+        if self._cohort is None:
+            with self._cohort_lock:
+                if self._cohort is None:
+                    self._cohort = self._load_or_build_cohort()
+        return self._cohort
+
+    def _cohort_path(self):
+        return self.data_dir / CACHE_DIR_NAME / COHORT_FILE_NAME
+
+    def _load_or_build_cohort(self):
+        fingerprint = None
+        if self.data_dir is not None:
+            fingerprint = data_fingerprint(self.data_dir)
+            sketch = CohortSketch.load(self._cohort_path())
+            if sketch is not None and sketch.fingerprint == fingerprint:
+                return sketch
+        with span("build_cohort"):
+            keys = [k for k in self.wallet_keys() if isinstance(k, bytes)]
+            frame = _batch_features(["0x" + k.hex() for k in keys], self)
+            sketch = CohortSketch.build(keys, frame, fingerprint)
+        if self.data_dir is not None:
+            sketch.save(self._cohort_path())
+        return sketch
+
+    def wallet_rows(self, name, wallet_address):
+        """Rows of table ``name`` belonging to ``wallet_address`` (possibly empty)."""
+        with self._lock:
+            df = self.tables.get(name, pd.DataFrame())
+            positions = self.wallet_positions(name, wallet_address)
+        return df.iloc[positions]
+
+    def upsert(self, new_tables):
+        """Merge freshly fetched per-wallet tables into the store.
+
+        Rows are appended to each table and only the new rows are indexed; a
+        wallet that already had rows in a table is re-pointed at the new ones.
+        The new table and index are built first and then swapped in, table
+        before index, so a lock-free reader never holds positions past the end
+        of the table it reads.
+        """
+        with self._lock:
+            new_keys = set()
+            for name, new_rows in new_tables.items():
+                if new_rows is None or new_rows.empty:
+                    continue
+                new_rows = _normalize_wallet_columns(new_rows.copy())
+                column = next((c for c in WALLET_KEY_COLUMNS if c in new_rows.columns), None)
+                if column is not None:
+                    new_keys.update(k for k in _address_keys(new_rows[column]) if isinstance(k, bytes))
+                df = self.tables.get(name, pd.DataFrame())
+                offset = len(df)
+                table = new_rows.reset_index(drop=True) if df.empty else pd.concat(
+                    [df, new_rows], ignore_index=True)
+                entry = self._index.get(name)
+                if entry is None or entry[0] not in new_rows.columns:
+                    entry = _table_index(table)
+                else:
+                    column, groups = entry
+                    keys = _address_keys(new_rows[column].reset_index(drop=True))
+                    groups = dict(groups)
+                    for key, positions in keys.groupby(keys, sort=False).indices.items():
+                        groups[key] = positions + offset
+                    entry = (column, groups)
+                self.tables[name] = table
+                if entry is not None:
+                    self._index[name] = entry
+                self._arrays = {k: v for k, v in self._arrays.items() if k[0] != name}
+                if self.persist:
+                    append_csv(self.data_dir / DELTA_DIR_NAME / DATA_FILES[name], new_rows)
+                    self._pending_delta_rows += len(new_rows)
+            if self.persist and self._pending_delta_rows >= COMPACT_AFTER_ROWS:
+                compact_deltas(self.data_dir)
+                self._pending_delta_rows = 0
+            # An unbuilt cohort will see these rows when it is built.
+            if self._cohort is not None and new_keys:
+                self._add_to_cohort(new_keys)
+
+    def _add_to_cohort(self, keys):
+        """Rank newly merged wallets in the cohort; a persisted sketch is rewritten to match the files."""
+        added = False
+        for key in keys:
+            if key not in self._cohort:
+                features = _compute_features("0x" + key.hex(), self)
+                added |= self._cohort.add(key, features)
+        if added and self.persist:
+            self._cohort.fingerprint = data_fingerprint(self.data_dir)
+            self._cohort.save(self._cohort_path())
+
+
+def load_wallet_store(data_dir="data", persist_fetched=False, memory_budget_mb=None):
+    """Load the wallet CSVs and index them by wallet address.
+
+    With ``persist_fetched``, wallets merged in from the API are also written
+    to the append-only delta files so they survive a restart.
+    ``memory_budget_mb`` is passed on to ``load_wallet_data``. The cohort
+    percentile sketch used by the scores is loaded (or built) here too, so the
+    first wallet scored does not pay for it.
+    """
+    data = load_wallet_data(data_dir, memory_budget_mb=memory_budget_mb)
+    store = WalletStore(data, data_dir=data_dir, persist=persist_fetched)
+    store.cohort
+    return store
+
+
+def _wallet_positions(data_dict, table, column, wallet_address):
+    """Row positions of ``wallet_address`` in ``data_dict[table]`` (empty if none)."""
+    if isinstance(data_dict, WalletStore):
+        return data_dict.wallet_positions(table, wallet_address)
+    df = data_dict[table]
+    if column not in df.columns:
+        return _NO_ROWS
+    matches = df[column] == normalize_address(wallet_address)
+    return np.flatnonzero(matches.to_numpy(dtype=bool, na_value=False))
+
+
+def _column_values(data_dict, table, column):
+    """NumPy values of ``data_dict[table][column]``, or None if the column is missing."""
+    if isinstance(data_dict, WalletStore):
+        return data_dict.column_values(table, column)
+    df = data_dict[table]
+    return df[column].to_numpy() if column in df.columns else None
+
+
+def _scan_for_wallet(data_dict, wallet_address):
+    """Linear existence check used when ``data_dict`` is a plain dict of tables."""
+    wallet_address = normalize_address(wallet_address)
+    for key, df in data_dict.items():
+        if not df.empty and ("wallet" in df.columns or "address" in df.columns):
+            col = "wallet" if "wallet" in df.columns else "address"
+            if wallet_address in df[col].values:
+                return True
+    return False
+
+
+def _count_unique(values):
+    """Number of distinct non-missing values (``Series.nunique``)."""
+    uniques = pd.unique(values)
+    return len(uniques) - int(pd.isna(uniques).sum())
+
+
+def top_k_positions(values, k=3):
+    """Indices of the ``k`` largest ``values``, descending, ties in original order, NaN last.
+
+    Same order as a stable descending sort followed by ``head(k)``, but large
+    inputs are first narrowed with ``np.argpartition`` instead of fully sorted.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) > 4 * k:
+        negated = -values
+        finite = ~np.isnan(negated)
+        if finite.sum() >= k:
+            threshold = np.partition(negated[finite], k - 1)[k - 1]
+            candidates = np.flatnonzero(finite & (negated <= threshold))
+            return candidates[np.argsort(negated[candidates], kind="stable")[:k]]
+    return np.argsort(-values, kind="stable")[:k]
+
+
+def _row_values(data_dict, table, column, positions, default):
+    values = _column_values(data_dict, table, column)
+    return [default] * len(positions) if values is None else [values[i] for i in positions]
+
+
+@traced("extract_wallet_features")
 def extract_wallet_features(wallet_address, data_dict):
-    """Extract features from wallet data, fetching from API if not found locally."""
-    features = {"address": wallet_address}
+    """``WalletFeatures`` for a wallet, fetching from the API if it is not found locally.
 
+    Health and risk scores are percentiles within the cohort of a
+    ``WalletStore`` or ``WalletDatabase``. A plain dict of tables (as returned
+    by ``load_wallet_data``) has no cohort and keeps the legacy fixed-cap
+    scoring, so its scores and recommendations can differ from the store's
+    for the same wallet; use ``load_wallet_store`` for cohort scores.
+    """
     # Validate wallet address format
     if not isinstance(wallet_address, str) or not wallet_address.startswith("0x") or len(wallet_address) != 42:
         raise ValueError("Invalid wallet address format. Please enter a valid Ethereum address (0x... and 42 characters long).")
 
     # Check if wallet exists in any local data file
-    wallet_exists = False
-    for key, df in data_dict.items():
-        if not df.empty and ("wallet" in df.columns or "address" in df.columns):
-            col = "wallet" if "wallet" in df.columns else "address"
-            if wallet_address in df[col].values:
-                wallet_exists = True
-                break
+    with span("wallet_lookup"):
+        if isinstance(data_dict, (WalletStore, WalletDatabase)):
+            wallet_exists = data_dict.has_wallet(wallet_address)
+        else:
+            wallet_exists = _scan_for_wallet(data_dict, wallet_address)
 
     # If wallet not found in local data, try fetching from API
     if not wallet_exists:
         print(f"Wallet {wallet_address} not found in local data. Fetching from Moralis API...")
         api_data = fetch_wallet_data_from_api(wallet_address)
         if api_data:
-            data_dict = api_data
+            if isinstance(data_dict, WalletStore):
+                # Keep the local tables and make the wallet a local hit next time.
+                data_dict.upsert(api_data)
+            elif isinstance(data_dict, WalletDatabase):
+                # The database is read-only; score the fetched tables against its cohort.
+                data_dict = WalletStore(api_data, cohort=data_dict.cohort)
+            else:
+                data_dict = api_data
             print("Successfully fetched wallet data from API")
         else:
             print("Failed to fetch data from API")
             raise ValueError("Wallet address not found in local data or via Moralis API. Please check the address and try again.")
 
-    # --- Networth ---
-    networth_df = data_dict.get("networth", pd.DataFrame())
-    if not networth_df.empty:
-        row = networth_df[networth_df["wallet"] == wallet_address]
-        if not row.empty:
-            row = row.iloc[0]
-            features.update({
-                "total_networth": float(row.get("total_networth_usd", 0) or 0),
-                "native_balance": float(row.get("native_balance", 0) or 0),
-                "token_balance_usd": float(row.get("token_balance_usd", 0) or 0),
-                "chain": row.get("chain", "unknown") or "unknown",
-                "token_ratio": float(row.get("token_balance_usd", 0) or 0) / max(float(row.get("total_networth_usd", 1) or 1), 1)
-            })
-        else:
-            features.update({
-                "total_networth": 0,
-                "native_balance": 0,
-                "token_balance_usd": 0,
-                "chain": "unknown",
-                "token_ratio": 0
-            })
+    if isinstance(data_dict, WalletDatabase):
+        return data_dict.wallet_features(wallet_address)
+    return _compute_features(wallet_address, data_dict)
+
+
+@traced("feature_math")
+def _compute_features(wallet_address, data_dict):
+    """``WalletFeatures`` for a wallet known to be in ``data_dict``.
+
+    Each table contributes in a single pass over the wallet's row positions:
+    scalars are read straight from column arrays, top tokens come from a
+    partial sort, and the classification is computed once.
+    """
+    features = {"address": wallet_address}
+
+    def table_rows(table, column):
+        df = data_dict.get(table)
+        if df is None or df.empty:
+            return None
+        return _wallet_positions(data_dict, table, column, wallet_address)
+
+    # --- Networth (one row per chain: USD token balances are summed, the total repeats on each row) ---
+    rows = table_rows("networth", "wallet")
+    if rows is not None and len(rows):
+        def column(name, default=0):
+            return [float(v or 0) for v in _row_values(data_dict, "networth", name, rows, default)]
+
+        total = column("total_networth_usd")[0]
+        token_balance = float(np.nansum(column("token_balance_usd")))
+        # The wallet's chain is the one holding most of its net worth (the first row on ties); native
+        # balances are in each chain's own coin, so only that chain's is reported.
+        worth = [-np.inf if np.isnan(v) else v for v in column("chain_networth_usd")]
+        top = max(range(len(rows)), key=worth.__getitem__)
+        features.update({
+            "total_networth": total,
+            "native_balance": column("native_balance")[top],
+            "token_balance_usd": token_balance,
+            "chain": _row_values(data_dict, "networth", "chain", rows, "unknown")[top] or "unknown",
+            "token_ratio": token_balance / max(float(total or 1), 1)
+        })
     else:
         features.update({
             "total_networth": 0,
@@ -188,27 +1321,16 @@ def extract_wallet_features(wallet_address, data_dict):
             "token_ratio": 0
         })
 
-    # --- Wallet Stats ---
-    stats_df = data_dict.get("stats", pd.DataFrame())
-    if not stats_df.empty:
-        row = stats_df[stats_df["wallet"] == wallet_address]
-        if not row.empty:
-            row = row.iloc[0]
-            features.update({
-                "transactions_total": int(row.get("transactions_total", 0) or 0),
-                "nft_transfers_total": int(row.get("nft_transfers_total", 0) or 0),
-                "token_transfers_total": int(row.get("token_transfers_total", 0) or 0),
-                "nft_count": int(row.get("nfts", 0) or 0),
-                "nft_collections": int(row.get("collections", 0) or 0)
-            })
-        else:
-            features.update({
-                "transactions_total": 0,
-                "nft_transfers_total": 0,
-                "token_transfers_total": 0,
-                "nft_count": 0,
-                "nft_collections": 0
-            })
+    # --- Wallet Stats (summed over the wallet's rows, one per chain when fetched live) ---
+    rows = table_rows("stats", "wallet")
+    if rows is not None and len(rows):
+        for feature, column in (("transactions_total", "transactions_total"),
+                                ("nft_transfers_total", "nft_transfers_total"),
+                                ("token_transfers_total", "token_transfers_total"),
+                                ("nft_count", "nfts"),
+                                ("nft_collections", "collections")):
+            values = _column_values(data_dict, "stats", column)
+            features[feature] = 0 if values is None else sum(int(v or 0) for v in values[rows])
     else:
         features.update({
             "transactions_total": 0,
@@ -219,58 +1341,76 @@ def extract_wallet_features(wallet_address, data_dict):
         })
 
     # --- Token Balances ---
-    token_df = data_dict.get("tokens", pd.DataFrame())
-    if not token_df.empty and "wallet" in token_df.columns:
-        user_tokens = token_df[token_df["wallet"] == wallet_address]
-        features.update({
-            "token_count": user_tokens["token_symbol"].nunique() if "token_symbol" in user_tokens.columns else 0,
-            "top_tokens": user_tokens.sort_values("usd_value", ascending=False).head(3)["token_symbol"].tolist() if "token_symbol" in user_tokens.columns and "usd_value" in user_tokens.columns else []
-        })
-    else:
-        features.update({
-            "token_count": 0,
-            "top_tokens": []
-        })
+    features["token_count"] = 0
+    features["top_tokens"] = []
+    rows = table_rows("tokens", "wallet") if "wallet" in data_dict.get("tokens", _EMPTY_FRAME).columns else None
+    if rows is not None:
+        symbols = _column_values(data_dict, "tokens", "token_symbol")
+        usd_values = _column_values(data_dict, "tokens", "usd_value")
+        if symbols is not None:
+            user_symbols = symbols[rows]
+            features["token_count"] = _count_unique(user_symbols)
+            if usd_values is not None:
+                features["top_tokens"] = user_symbols[top_k_positions(usd_values[rows], 3)].tolist()
+    # Wallets fetched page by page keep only their top rows; the full count is in the summary.
+    rows = table_rows("token_summary", "wallet")
+    if rows is not None and len(rows):
+        features["token_count"] = int(_column_values(data_dict, "token_summary", "token_count")[rows[-1]])
 
     # --- DeFi Positions ---
-    defi_df = data_dict.get("defi", pd.DataFrame())
-    if not defi_df.empty:
-        user_defi = defi_df[defi_df["wallet"] == wallet_address]
+    rows = table_rows("defi", "wallet")
+    if rows is not None and len(rows):
         features.update({
-            "defi_protocols": user_defi["protocol_name"].nunique() if not user_defi.empty else 0,
-            "total_defi_usd": user_defi["usd_value"].sum() if not user_defi.empty else 0.0
+            "defi_protocols": _count_unique(_column_values(data_dict, "defi", "protocol_name")[rows]),
+            "total_defi_usd": np.nansum(_column_values(data_dict, "defi", "usd_value")[rows].astype(float))
         })
     else:
         features.update({
             "defi_protocols": 0,
             "total_defi_usd": 0.0
         })
+    # Tables aggregated out of core keep only per-wallet DeFi totals.
+    rows = table_rows("defi_summary", "wallet")
+    if rows is not None and len(rows):
+        features["defi_protocols"] = int(_column_values(data_dict, "defi_summary", "defi_protocols")[rows[-1]])
+        features["total_defi_usd"] = float(_column_values(data_dict, "defi_summary", "total_defi_usd")[rows[-1]])
 
     # --- NFT Collections (from cleaned NFT file) ---
-    nfts_df = data_dict.get("nfts", pd.DataFrame())
-    if not nfts_df.empty and "wallet_address" in nfts_df.columns:
-        user_nfts = nfts_df[nfts_df["wallet_address"] == wallet_address]
-        features["unique_nft_collections"] = user_nfts["token_address"].nunique() if not user_nfts.empty else features.get("nft_collections", 0)
-    else:
-        features["unique_nft_collections"] = features.get("nft_collections", 0)
+    features["unique_nft_collections"] = features.get("nft_collections", 0)
+    if "wallet_address" in data_dict.get("nfts", _EMPTY_FRAME).columns:
+        rows = table_rows("nfts", "wallet_address")
+        if rows is not None and len(rows):
+            features["unique_nft_collections"] = _count_unique(_column_values(data_dict, "nfts", "token_address")[rows])
+    rows = table_rows("nft_summary", "wallet")
+    if rows is not None and len(rows):
+        features["unique_nft_collections"] = int(
+            _column_values(data_dict, "nft_summary", "unique_nft_collections")[rows[-1]])
 
     # --- Active Chains ---
-    active_chains_df = data_dict.get("active_chains", pd.DataFrame())
-    if not active_chains_df.empty and "wallet" in active_chains_df.columns and "chain" in active_chains_df.columns:
-        user_chains = active_chains_df[active_chains_df["wallet"] == wallet_address]
-        features["active_chains"] = user_chains["chain"].unique().tolist() if not user_chains.empty else []
-    else:
-        features["active_chains"] = []
+    features["active_chains"] = []
+    active_chains_df = data_dict.get("active_chains", _EMPTY_FRAME)
+    if "wallet" in active_chains_df.columns and "chain" in active_chains_df.columns:
+        rows = table_rows("active_chains", "wallet")
+        if rows is not None and len(rows):
+            features["active_chains"] = pd.unique(_column_values(data_dict, "active_chains", "chain")[rows]).tolist()
 
     # --- Wallets List (for possible bulk features) ---
-    wallets_df = data_dict.get("wallets", pd.DataFrame())
     features["in_wallets_list"] = False
-    if not wallets_df.empty:
-        if "wallet" in wallets_df.columns and wallet_address in wallets_df["wallet"].values:
+    wallets_df = data_dict.get("wallets", _EMPTY_FRAME)
+    if isinstance(data_dict, WalletStore):
+        features["in_wallets_list"] = len(data_dict.wallet_positions("wallets", wallet_address)) > 0
+    elif not wallets_df.empty:
+        key = normalize_address(wallet_address)
+        if "wallet" in wallets_df.columns and key in wallets_df["wallet"].values:
             features["in_wallets_list"] = True
-        elif "address" in wallets_df.columns and wallet_address in wallets_df["address"].values:
+        elif "address" in wallets_df.columns and key in wallets_df["address"].values:
             features["in_wallets_list"] = True
 
+    return _scored_record(features, data_dict.cohort if isinstance(data_dict, WalletStore) else None)
+
+
+def _scored_record(features, cohort=None):
+    """``WalletFeatures`` from the table-derived ``features``, with the derived scores and labels added."""
     # Derived Scores
     features["activity_score"] = (
         features.get("transactions_total", 0) +
@@ -278,10 +1418,15 @@ def extract_wallet_features(wallet_address, data_dict):
         features.get("token_transfers_total", 0)
     )
 
-    # Wallet Health Score (0-100)
-    activity_norm = min(features["activity_score"] / 100, 1.0)
-    networth_norm = min(features["total_networth"] / 10_000, 1.0)
-    defi_norm = min(features["total_defi_usd"] / 5_000, 1.0)
+    # Wallet Health Score (0-100), on percentiles within the cohort when there is one (legacy caps without)
+    if cohort:
+        activity_norm = cohort.percentile("activity_score", features["activity_score"])
+        networth_norm = cohort.percentile("total_networth", features["total_networth"])
+        defi_norm = cohort.percentile("total_defi_usd", features["total_defi_usd"])
+    else:
+        activity_norm = min(features["activity_score"] / 100, 1.0)
+        networth_norm = min(features["total_networth"] / 10_000, 1.0)
+        defi_norm = min(features["total_defi_usd"] / 5_000, 1.0)
     wallet_health = (0.4 * activity_norm + 0.4 * networth_norm + 0.2 * defi_norm) * 100
     features["wallet_health_score"] = round(wallet_health, 1)
 
@@ -289,18 +1434,10 @@ def extract_wallet_features(wallet_address, data_dict):
     risk_raw = (1 - networth_norm) * 0.5 + (1 - activity_norm) * 0.3 + (1 - defi_norm) * 0.2
     features["risk_score"] = round(risk_raw * 100, 1)  # Higher means riskier
 
-    # Generate simple AI social handle (just a placeholder using wallet prefix + classification)
-    features["social_handle"] = generate_social_handle(wallet_address)
-
-    # Generate dApp/NFT recommendations based on wallet profile (simplified)
-    # We will assign classifications later, so skip referencing them here
-    
-
-    classifications = classify_wallet(features)
-    features["recommendations"] = generate_recommendations(features, classifications)
-    features["persona_profile"] = generate_persona_profile(features, classifications)
-
-    return features
+    # Classify once; the social handle and the text fields are derived on access.
+    record = WalletFeatures(**features)
+    record.labels = labels_to_flags(classify_wallet(record))
+    return record
 
 
 def classify_wallet(features):
@@ -342,6 +1479,799 @@ def classify_wallet(features):
     return classification
 
 
+# Label columns produced by classify_wallets, in classify_wallet's order.
+CLASSIFICATION_LABELS = (
+    "whale", "large_holder", "token_diversified", "token_explorer", "nft_whale",
+    "nft_collector", "nft_trader", "defi_power_user", "defi_whale", "power_user",
+    "high_volume_trader", "retail_user",
+)
+
+
+def classify_wallets(features_df):
+    """Vectorized ``classify_wallet``: a boolean label matrix with one row per wallet."""
+    def col(name):
+        if name in features_df.columns:
+            return features_df[name]
+        return pd.Series(0, index=features_df.index)
+
+    networth = col("total_networth")
+    labels = pd.DataFrame(index=features_df.index)
+    labels["whale"] = networth > 1_000_000
+    labels["large_holder"] = (networth > 100_000) & ~labels["whale"]
+    labels["token_diversified"] = col("token_ratio") > 0.7
+    labels["token_explorer"] = col("token_count") > 25
+    labels["nft_whale"] = col("unique_nft_collections") > 20
+    labels["nft_collector"] = (col("nft_count") > 10) & ~labels["nft_whale"]
+    labels["nft_trader"] = col("nft_transfers_total") > 200
+    labels["defi_power_user"] = col("defi_protocols") > 5
+    labels["defi_whale"] = col("total_defi_usd") > 100_000
+    labels["power_user"] = col("transactions_total") > 100_000
+    labels["high_volume_trader"] = col("token_transfers_total") > 100_000
+    labels["retail_user"] = ~labels.any(axis=1)
+    return labels[list(CLASSIFICATION_LABELS)]
+
+
+def labels_to_lists(labels):
+    """Turn a ``classify_wallets`` label matrix into per-wallet label lists."""
+    names = np.array(labels.columns)
+    return [names[row].tolist() for row in labels.to_numpy()]
+
+
+# One bit per classification label, in CLASSIFICATION_LABELS order.
+WalletLabel = IntFlag("WalletLabel", [name.upper() for name in CLASSIFICATION_LABELS])
+
+
+def labels_to_flags(names):
+    """``WalletLabel`` flags for a list of label names."""
+    flags = WalletLabel(0)
+    for name in names:
+        flags |= WalletLabel[name.upper()]
+    return flags
+
+
+def flags_to_labels(flags):
+    """Label names set in ``flags``, in CLASSIFICATION_LABELS order."""
+    flags = int(flags)
+    return [name for bit, name in enumerate(CLASSIFICATION_LABELS) if flags >> bit & 1]
+
+
+def label_matrix_to_flags(labels):
+    """Vectorized ``labels_to_flags`` for a ``classify_wallets`` label matrix."""
+    bits = (1 << np.arange(len(labels.columns))).astype(np.uint16)
+    return labels.to_numpy().astype(np.uint16) @ bits
+
+
+# Keys of a feature record, in the order ``to_dict`` emits them.
+FEATURE_KEYS = (
+    "address", "total_networth", "native_balance", "token_balance_usd", "chain", "token_ratio",
+    "transactions_total", "nft_transfers_total", "token_transfers_total", "nft_count", "nft_collections",
+    "token_count", "top_tokens", "defi_protocols", "total_defi_usd", "unique_nft_collections",
+    "active_chains", "in_wallets_list", "activity_score", "wallet_health_score", "risk_score",
+    "social_handle", "classifications", "recommendations", "persona_profile",
+)
+TEXT_KEYS = ("recommendations", "persona_profile")
+
+
+@dataclass(slots=True, eq=False)
+class WalletFeatures(Mapping):
+    """One wallet's features as a slotted record.
+
+    Classification labels are held as ``WalletLabel`` bits. The social handle,
+    recommendations and Markdown persona profile are derived on first access
+    rather than stored up front. The record reads like the old feature dict
+    (``features["token_count"]``, ``features.get(...)``); use ``to_dict()``
+    for JSON.
+    """
+
+    address: str
+    total_networth: float = 0.0
+    native_balance: float = 0.0
+    token_balance_usd: float = 0.0
+    chain: str = "unknown"
+    token_ratio: float = 0.0
+    transactions_total: int = 0
+    nft_transfers_total: int = 0
+    token_transfers_total: int = 0
+    nft_count: int = 0
+    nft_collections: int = 0
+    token_count: int = 0
+    top_tokens: list = field(default_factory=list)
+    defi_protocols: int = 0
+    total_defi_usd: float = 0.0
+    unique_nft_collections: int = 0
+    active_chains: list = field(default_factory=list)
+    in_wallets_list: bool = False
+    activity_score: int = 0
+    wallet_health_score: float = 0.0
+    risk_score: float = 0.0
+    labels: WalletLabel = WalletLabel(0)
+    _recommendations: list = field(default=None, repr=False)
+    _persona_profile: str = field(default=None, repr=False)
+
+    @property
+    def social_handle(self):
+        return generate_social_handle(self.address)
+
+    @property
+    def classifications(self):
+        return flags_to_labels(self.labels)
+
+    @property
+    def recommendations(self):
+        if self._recommendations is None:
+            self._recommendations = generate_recommendations(self, self.classifications)
+        return self._recommendations
+
+    @property
+    def persona_profile(self):
+        if self._persona_profile is None:
+            self._persona_profile = generate_persona_profile(self, self.classifications, self.recommendations)
+        return self._persona_profile
+
+    def __getitem__(self, key):
+        if key not in FEATURE_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(FEATURE_KEYS)
+
+    def __len__(self):
+        return len(FEATURE_KEYS)
+
+    def to_dict(self, text=True):
+        """Plain dict in the old feature-dict layout; ``text=False`` skips the rendered text fields."""
+        out = {key: self[key] for key in FEATURE_KEYS if text or key not in TEXT_KEYS}
+        out["top_tokens"] = list(self.top_tokens)
+        out["active_chains"] = list(self.active_chains)
+        if text:
+            out["recommendations"] = list(out["recommendations"])
+        return out
+
+
+class _ListColumn:
+    """A column of short string lists stored as offsets into interned category codes."""
+
+    def __init__(self, codes, offsets, categories):
+        self.codes = codes
+        self.offsets = offsets
+        self.categories = categories
+
+    @classmethod
+    def from_lists(cls, lists):
+        lengths = np.fromiter((len(v) for v in lists), dtype=np.int64, count=len(lists))
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        flat = pd.Categorical([item for v in lists for item in v])
+        categories = np.asarray(flat.categories, dtype=object)
+        return cls(flat.codes.astype(np.int32), offsets, categories)
+
+    def row(self, i):
+        return self.categories[self.codes[self.offsets[i]:self.offsets[i + 1]]].tolist()
+
+    def take(self, positions):
+        return _ListColumn.from_lists([self.row(i) for i in positions])
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.offsets.nbytes + self.categories.nbytes
+
+
+# Scalar columns of a WalletFeatureTable and the dtype each is stored as.
+_TABLE_COLUMNS = {
+    "total_networth": np.float64, "native_balance": np.float64, "token_balance_usd": np.float64,
+    "token_ratio": np.float64, "transactions_total": np.int64, "nft_transfers_total": np.int64,
+    "token_transfers_total": np.int64, "nft_count": np.int64, "nft_collections": np.int64,
+    "token_count": np.int64, "defi_protocols": np.int64, "total_defi_usd": np.float64,
+    "unique_nft_collections": np.int64, "in_wallets_list": np.bool_, "activity_score": np.int64,
+    "wallet_health_score": np.float64, "risk_score": np.float64,
+}
+
+
+class WalletFeatureTable:
+    """Many wallets' features in column arrays.
+
+    Numbers live in typed NumPy arrays, ``chain`` is categorical, list fields
+    are offset-encoded over interned strings, and classifications are one
+    ``uint16`` of ``WalletLabel`` bits per wallet. Indexing a row returns a
+    ``WalletFeatures`` whose text fields are rendered only if read.
+    """
+
+    def __init__(self, addresses, chain, columns, top_tokens, active_chains, labels):
+        self.addresses = addresses
+        self.chain = chain
+        self.columns = columns
+        self.top_tokens = top_tokens
+        self.active_chains = active_chains
+        self.labels = labels
+
+    @classmethod
+    def from_frame(cls, df, labels=None):
+        """Build from an ``extract_features_batch`` frame (classified here unless ``labels`` are given)."""
+        if labels is None:
+            labels = label_matrix_to_flags(classify_wallets(df))
+        return cls(
+            addresses=df["address"].astype(str).to_numpy(dtype=object),
+            chain=pd.Categorical(df["chain"].astype(str)),
+            columns={name: df[name].to_numpy(dtype=dtype) for name, dtype in _TABLE_COLUMNS.items()},
+            top_tokens=_ListColumn.from_lists(list(df["top_tokens"])),
+            active_chains=_ListColumn.from_lists(list(df["active_chains"])),
+            labels=np.asarray(labels, dtype=np.uint16),
+        )
+
+    @classmethod
+    def from_records(cls, records):
+        """Build from ``WalletFeatures`` (or feature dicts), keeping their classifications."""
+        records = list(records)
+        frame = pd.DataFrame([{key: r[key] for key in FEATURE_KEYS if key not in TEXT_KEYS}
+                              for r in records], columns=[k for k in FEATURE_KEYS if k not in TEXT_KEYS])
+        labels = [int(r.labels) if isinstance(r, WalletFeatures) else int(labels_to_flags(r["classifications"]))
+                  for r in records]
+        return cls.from_frame(frame, labels=labels)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __getitem__(self, i):
+        return WalletFeatures(
+            address=self.addresses[i],
+            chain=self.chain[i],
+            top_tokens=self.top_tokens.row(i),
+            active_chains=self.active_chains.row(i),
+            labels=WalletLabel(int(self.labels[i])),
+            **{name: values[i].item() for name, values in self.columns.items()},
+        )
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def take(self, positions):
+        """A new table with the rows at ``positions``."""
+        positions = np.asarray(positions, dtype=np.intp)
+        return WalletFeatureTable(
+            addresses=self.addresses[positions],
+            chain=self.chain[positions],
+            columns={name: values[positions] for name, values in self.columns.items()},
+            top_tokens=self.top_tokens.take(positions),
+            active_chains=self.active_chains.take(positions),
+            labels=self.labels[positions],
+        )
+
+    def with_label(self, label):
+        """Rows classified with ``label`` (a ``WalletLabel`` or label name)."""
+        if isinstance(label, str):
+            label = WalletLabel[label.upper()]
+        return self.take(np.flatnonzero(self.labels & np.uint16(label)))
+
+    def to_frame(self):
+        """A DataFrame in the ``extract_features_batch`` layout."""
+        df = pd.DataFrame({"address": self.addresses, "chain": self.chain, **self.columns})
+        df["top_tokens"] = [self.top_tokens.row(i) for i in range(len(self))]
+        df["active_chains"] = [self.active_chains.row(i) for i in range(len(self))]
+        df["social_handle"] = "CryptoWolf_" + df["address"].str[:6] + "_" + df["address"].str[-4:]
+        df["classifications"] = [flags_to_labels(flags) for flags in self.labels]
+        return df
+
+    def to_dicts(self, text=True):
+        return [record.to_dict(text=text) for record in self]
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the table's arrays (address strings excluded)."""
+        return (self.addresses.nbytes + self.chain.codes.nbytes + self.labels.nbytes
+                + sum(values.nbytes for values in self.columns.values())
+                + self.top_tokens.nbytes + self.active_chains.nbytes)
+
+
+def _keyed_rows(df, column, keys):
+    """Rows of ``df`` whose ``column`` address key is in ``keys``, tagged with ``_key``."""
+    df = df.assign(_key=_address_keys(df[column]))
+    return df[df["_key"].isin(keys)]
+
+
+def _networth_frame(rows):
+    """Per-wallet net worth from per-chain ``rows``.
+
+    The total comes from the first row, USD token balances are summed, and the
+    chain and its native balance (in that chain's own coin) come from the row
+    with the highest chain net worth.
+    """
+    top = rows.sort_values("chain_networth", ascending=False, kind="stable").drop_duplicates("_key")
+    top = top.set_index("_key")
+    out = rows.drop_duplicates("_key")[["_key", "total_networth"]].set_index("_key")
+    out["native_balance"] = top["native_balance"]
+    out = out.join(rows.groupby("_key")[["token_balance_usd"]].sum())
+    out["chain"] = top["chain"]
+    out["chain"] = out["chain"].where(out["chain"] != "", "unknown")
+    out["token_ratio"] = out["token_balance_usd"] / np.maximum(out["total_networth"], 1)
+    return out.reset_index()
+
+
+def _merge_wallet_frame(out, frame, defaults):
+    """Left-join per-wallet ``frame`` onto ``out``, filling wallets with no rows."""
+    out = out.merge(frame, on="_key", how="left")
+    found = out["_key"].isin(frame["_key"])
+    for name, default in defaults.items():
+        out[name] = out[name].where(found, default)
+    return out
+
+
+def _summary_override(out, data_dict, table, column, keys, dtype="int64"):
+    """``out[column]`` with the latest value from summary ``table`` for wallets that have one."""
+    summary = data_dict.get(table, _EMPTY_FRAME)
+    if summary.empty or column not in summary.columns:
+        return out[column]
+    latest = _keyed_rows(summary, "wallet", keys).drop_duplicates("_key", keep="last").set_index("_key")[column]
+    return out["_key"].map(latest).fillna(out[column]).astype(dtype)
+
+
+def extract_features_batch(addresses, data_dict):
+    """Compute wallet features for many addresses in one column-oriented pass.
+
+    Produces the same values as ``extract_wallet_features`` for wallets present
+    in local data, one row per address. Each table is reduced with a single
+    groupby and merged onto the address list; nothing is fetched from the API.
+    The text fields (``recommendations``, ``persona_profile``) are left to the
+    per-wallet path. A ``WalletDatabase`` computes the table columns in SQL.
+    Scores follow the same rule as ``extract_wallet_features``: cohort
+    percentiles for a store or database, legacy fixed caps for a plain dict.
+    """
+    if isinstance(data_dict, WalletDatabase):
+        out = data_dict.batch_features(addresses)
+    else:
+        out = _batch_features(addresses, data_dict)
+
+    # Derived Scores
+    cohort = data_dict.cohort if isinstance(data_dict, (WalletStore, WalletDatabase)) else None
+    if cohort:
+        activity_norm = cohort.percentile("activity_score", out["activity_score"])
+        networth_norm = cohort.percentile("total_networth", out["total_networth"])
+        defi_norm = cohort.percentile("total_defi_usd", out["total_defi_usd"])
+    else:
+        activity_norm = np.minimum(out["activity_score"] / 100, 1.0)
+        networth_norm = np.minimum(out["total_networth"] / 10_000, 1.0)
+        defi_norm = np.minimum(out["total_defi_usd"] / 5_000, 1.0)
+    wallet_health = (0.4 * activity_norm + 0.4 * networth_norm + 0.2 * defi_norm) * 100
+    risk_raw = (1 - networth_norm) * 0.5 + (1 - activity_norm) * 0.3 + (1 - defi_norm) * 0.2
+    # Python's round, as in the per-wallet path (NumPy rounds some halves the other way).
+    out["wallet_health_score"] = [round(v, 1) for v in np.asarray(wallet_health, dtype=float).tolist()]
+    out["risk_score"] = [round(v, 1) for v in np.asarray(risk_raw * 100, dtype=float).tolist()]
+
+    out["social_handle"] = "CryptoWolf_" + out["address"].str[:6] + "_" + out["address"].str[-4:]
+    out["classifications"] = labels_to_lists(classify_wallets(out))
+    return out.drop(columns="_key")
+
+
+def _batch_features(addresses, data_dict):
+    """The table-derived columns of ``extract_features_batch`` (through ``activity_score``), keyed by ``_key``."""
+    out = pd.DataFrame({"address": list(addresses)})
+    out["_key"] = _address_keys(out["address"])
+    keys = pd.Index(out["_key"].unique())
+
+    # --- Networth (balances summed over each wallet's chain rows) ---
+    networth_df = data_dict.get("networth", pd.DataFrame())
+    networth_defaults = {"total_networth": 0.0, "native_balance": 0.0,
+                         "token_balance_usd": 0.0, "chain": "unknown"}
+    if not networth_df.empty:
+        rows = _keyed_rows(networth_df, "wallet", keys)
+        rows = pd.DataFrame({
+            "_key": rows["_key"],
+            "total_networth": rows.get("total_networth_usd", 0),
+            "native_balance": rows.get("native_balance", 0),
+            "token_balance_usd": rows.get("token_balance_usd", 0),
+            "chain_networth": rows.get("chain_networth_usd", 0),
+            "chain": rows.get("chain", "unknown"),
+        })
+        for name in ("total_networth", "native_balance", "token_balance_usd", "chain_networth"):
+            rows[name] = rows[name].astype(float)
+        networth = _networth_frame(rows)
+        out = _merge_wallet_frame(out, networth, {**networth_defaults, "token_ratio": 0.0})
+    else:
+        out = out.assign(**networth_defaults, token_ratio=0.0)
+
+    # --- Wallet Stats (summed per wallet) ---
+    stats_df = data_dict.get("stats", pd.DataFrame())
+    stats_cols = STATS_COLUMNS
+    if not stats_df.empty:
+        rows = _keyed_rows(stats_df, "wallet", keys)
+        summed = pd.DataFrame({"_key": rows["_key"], **{
+            name: pd.to_numeric(rows[source], errors="coerce").fillna(0) if source in rows.columns else 0
+            for source, name in stats_cols.items()}}).groupby("_key", sort=False).sum().reset_index()
+        out = _merge_wallet_frame(out, summed, dict.fromkeys(stats_cols.values(), 0))
+        out[list(stats_cols.values())] = out[list(stats_cols.values())].astype("int64")
+    else:
+        out = out.assign(**dict.fromkeys(stats_cols.values(), 0))
+
+    # --- Token Balances ---
+    token_df = data_dict.get("tokens", pd.DataFrame())
+    if not token_df.empty and "wallet" in token_df.columns and "token_symbol" in token_df.columns:
+        user_tokens = _keyed_rows(token_df, "wallet", keys)
+        grouped = pd.DataFrame({"token_count": user_tokens.groupby("_key")["token_symbol"].nunique()})
+        if "usd_value" in user_tokens.columns:
+            ranked = user_tokens.sort_values(["_key", "usd_value"], ascending=[True, False],
+                                             kind="mergesort", na_position="last")
+            grouped["top_tokens"] = ranked.groupby("_key").head(3).groupby("_key")["token_symbol"].agg(list)
+        else:
+            grouped["top_tokens"] = [[] for _ in range(len(grouped))]
+        out = out.merge(grouped, left_on="_key", right_index=True, how="left")
+        out["token_count"] = out["token_count"].fillna(0).astype("int64")
+        out["top_tokens"] = [v if isinstance(v, list) else [] for v in out["top_tokens"]]
+    else:
+        out["token_count"] = 0
+        out["top_tokens"] = [[] for _ in range(len(out))]
+    out["token_count"] = _summary_override(out, data_dict, "token_summary", "token_count", keys)
+
+    # --- DeFi Positions ---
+    defi_df = data_dict.get("defi", pd.DataFrame())
+    if not defi_df.empty:
+        grouped = _keyed_rows(defi_df, "wallet", keys).groupby("_key").agg(
+            defi_protocols=("protocol_name", "nunique"), total_defi_usd=("usd_value", "sum"))
+        out = out.merge(grouped, left_on="_key", right_index=True, how="left")
+        out["defi_protocols"] = out["defi_protocols"].fillna(0).astype("int64")
+        out["total_defi_usd"] = out["total_defi_usd"].fillna(0.0)
+    else:
+        out["defi_protocols"] = 0
+        out["total_defi_usd"] = 0.0
+    out["defi_protocols"] = _summary_override(out, data_dict, "defi_summary", "defi_protocols", keys)
+    out["total_defi_usd"] = _summary_override(out, data_dict, "defi_summary", "total_defi_usd", keys, "float64")
+
+    # --- NFT Collections (from cleaned NFT file) ---
+    nfts_df = data_dict.get("nfts", pd.DataFrame())
+    out["unique_nft_collections"] = out["nft_collections"]
+    if not nfts_df.empty and "wallet_address" in nfts_df.columns:
+        unique = _keyed_rows(nfts_df, "wallet_address", keys).groupby("_key")["token_address"].nunique()
+        matched = out["_key"].map(unique)
+        out["unique_nft_collections"] = matched.fillna(out["nft_collections"]).astype("int64")
+    out["unique_nft_collections"] = _summary_override(out, data_dict, "nft_summary", "unique_nft_collections", keys)
+
+    # --- Active Chains ---
+    active_chains_df = data_dict.get("active_chains", pd.DataFrame())
+    out["active_chains"] = [[] for _ in range(len(out))]
+    if not active_chains_df.empty and "wallet" in active_chains_df.columns and "chain" in active_chains_df.columns:
+        chains = _keyed_rows(active_chains_df, "wallet", keys).dropna(subset=["chain"])
+        chains = chains.drop_duplicates(["_key", "chain"]).groupby("_key")["chain"].agg(list)
+        out["active_chains"] = [v if isinstance(v, list) else [] for v in out["_key"].map(chains)]
+
+    # --- Wallets List ---
+    wallets_df = data_dict.get("wallets", pd.DataFrame())
+    out["in_wallets_list"] = False
+    if not wallets_df.empty:
+        column = "wallet" if "wallet" in wallets_df.columns else "address" if "address" in wallets_df.columns else None
+        if column:
+            out["in_wallets_list"] = out["_key"].isin(_keyed_rows(wallets_df, column, keys)["_key"])
+
+    out["activity_score"] = out["transactions_total"] + out["nft_transfers_total"] + out["token_transfers_total"]
+    return out
+
+
+def build_wallet_db(data_dir="data", path=None, memory_budget_mb=None):
+    """Write the tables of ``data_dir`` into a SQLite file and return its path.
+
+    Tables keep their loaded row order (as ``rowid``) and get an index on each
+    wallet column. The cohort sketch and the ``data_fingerprint`` the file was
+    built from are stored alongside. The file is written under a temporary
+    name and swapped in, so open readers keep their copy.
+    """
+    path = Path(path) if path is not None else Path(data_dir) / CACHE_DIR_NAME / WALLET_DB_FILE_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fingerprint = data_fingerprint(data_dir)
+    data = load_wallet_data(data_dir, memory_budget_mb=memory_budget_mb)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    with span("build_wallet_db"):
+        conn = sqlite3.connect(tmp_path)
+        try:
+            for name, df in data.items():
+                if df.columns.empty:
+                    continue
+                df.to_sql(name, conn, index=False)
+                for column in WALLET_KEY_COLUMNS:
+                    if column in df.columns:
+                        conn.execute(f'CREATE INDEX "{name}_{column}" ON "{name}" ("{column}")')
+            if {"wallet", "token_symbol", "usd_value"} <= set(data.get("tokens", _EMPTY_FRAME).columns):
+                # Top tokens are read in this order, and token counts from the index alone.
+                conn.execute("CREATE INDEX tokens_rank ON tokens (wallet, usd_value DESC, token_symbol)")
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                             [("version", WALLET_DB_FORMAT_VERSION), ("fingerprint", fingerprint)])
+            conn.commit()
+
+            db = WalletDatabase(tmp_path)
+            keys = [k for k in db.wallet_keys() if isinstance(k, bytes)]
+            sketch = CohortSketch.build(keys, db.batch_features(["0x" + k.hex() for k in keys]))
+            db.close()
+            conn.execute("CREATE TABLE cohort (name TEXT PRIMARY KEY, data BLOB)")
+            conn.executemany("INSERT INTO cohort VALUES (?, ?)",
+                             [(m, sketch.values[m].tobytes()) for m in COHORT_METRICS]
+                             + [("members", b"".join(sketch.members))])
+            conn.commit()
+        finally:
+            conn.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+def open_wallet_db(data_dir="data", path=None, memory_budget_mb=None):
+    """``WalletDatabase`` for ``data_dir``, (re)built first if missing or out of date."""
+    path = Path(path) if path is not None else Path(data_dir) / CACHE_DIR_NAME / WALLET_DB_FILE_NAME
+    if path.exists():
+        db = WalletDatabase(path)
+        if db.version == WALLET_DB_FORMAT_VERSION and db.fingerprint == data_fingerprint(data_dir):
+            return db
+        db.close()
+    build_wallet_db(data_dir, path, memory_budget_mb)
+    return WalletDatabase(path)
+
+
+class WalletDatabase:
+    """Wallet tables in a SQLite file written by ``build_wallet_db``.
+
+    Opening it reads only the table layout and the cohort sketch; per-wallet
+    features are SQL queries that seek the wallet indexes. Each thread (and
+    each forked process) opens its own read-only connection, so any number of
+    processes can share one file without holding the tables in memory.
+
+    ``batch_features`` returns the same frame as the DataFrame path, which
+    stays the reference to diff against.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        conn = self._connection()
+        names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        self.columns = {name: [row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')]
+                        for name in names if name not in ("meta", "cohort")}
+        # The column ``has_wallet`` looks in, chosen per table as WalletStore does.
+        self.wallet_columns = {name: column for name, columns in self.columns.items()
+                               for column in [next((c for c in WALLET_KEY_COLUMNS if c in columns), None)]
+                               if column is not None}
+        self.statements = self._feature_statements()
+        meta = dict(conn.execute("SELECT key, value FROM meta")) if "meta" in names else {}
+        self.version = meta.get("version")
+        self.fingerprint = meta.get("fingerprint")
+        self.cohort = None
+        if "cohort" in names:
+            blobs = dict(conn.execute("SELECT name, data FROM cohort"))
+            members = blobs.pop("members")
+            self.cohort = CohortSketch(
+                {m: np.frombuffer(blobs[m], dtype=np.float64) for m in COHORT_METRICS},
+                (members[i:i + KEY_BYTES] for i in range(0, len(members), KEY_BYTES)), self.fingerprint)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn, self._local.pid = conn, os.getpid()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _has(self, table, *columns):
+        return table in self.columns and all(c in self.columns[table] for c in columns)
+
+    def _feature_statements(self):
+        """The SQL behind each group of features, for the tables and columns this file has.
+
+        Every statement binds the queried wallets as one JSON array and returns
+        rows led by the wallet, so one wallet or thousands take the same query.
+        """
+        matching = "wallet IN (SELECT value FROM json_each(?))"
+        statements = {}
+        if self._has("networth", "wallet"):
+            # The total repeats on each chain row, so it comes from the first; the chain and its native
+            # balance (in that chain's own coin) come from the top earner's row.
+            total = '"total_networth_usd"' if self._has("networth", "total_networth_usd") else "0"
+            order = '"chain_networth_usd" DESC, ' if self._has("networth", "chain_networth_usd") else ""
+
+            def top_row(column, default):
+                if not self._has("networth", column):
+                    return default
+                return (f'(SELECT "{column}" FROM networth AS n WHERE n.wallet = networth.wallet '
+                        f"ORDER BY {order}n.rowid LIMIT 1)")
+
+            tokens = 'TOTAL("token_balance_usd")' if self._has("networth", "token_balance_usd") else "0"
+            statements["networth"] = (f"SELECT wallet, MIN(rowid) AS first_row, {total} AS total_networth_usd, "
+                                      f"{top_row('native_balance', '0')} AS native_balance, "
+                                      f"{tokens} AS token_balance_usd, {top_row('chain', repr('unknown'))} AS chain "
+                                      f"FROM networth WHERE {matching} GROUP BY wallet")
+        if self._has("stats", "wallet"):
+            columns = ", ".join(f'TOTAL("{source}") AS {name}' if self._has("stats", source) else f"0 AS {name}"
+                                for source, name in STATS_COLUMNS.items())
+            statements["stats"] = f"SELECT wallet, {columns} FROM stats WHERE {matching} GROUP BY wallet"
+        if self._has("tokens", "wallet", "token_symbol"):
+            statements["token_count"] = ("SELECT wallet, COUNT(DISTINCT token_symbol) AS token_count "
+                                         f"FROM tokens WHERE {matching} GROUP BY wallet")
+            if self._has("tokens", "usd_value"):
+                # Descending by value, NULL (NaN) last, ties in table order: as top_k_positions.
+                # Three rows are read per wallet off the tokens_rank index.
+                statements["top_tokens"] = (
+                    "SELECT t.wallet, t.token_symbol FROM json_each(?) AS q JOIN tokens AS t ON t.rowid IN ("
+                    "SELECT rowid FROM tokens WHERE wallet = q.value ORDER BY usd_value DESC, rowid LIMIT 3) "
+                    "ORDER BY t.wallet, t.usd_value DESC, t.rowid")
+        if self._has("defi", "wallet", "protocol_name", "usd_value"):
+            statements["defi"] = ("SELECT wallet, COUNT(DISTINCT protocol_name) AS defi_protocols, "
+                                  f"TOTAL(usd_value) AS total_defi_usd FROM defi WHERE {matching} GROUP BY wallet")
+        if self._has("nfts", "wallet_address", "token_address"):
+            statements["nfts"] = ("SELECT wallet_address AS wallet, COUNT(DISTINCT token_address) AS collections "
+                                  "FROM nfts WHERE wallet_address IN (SELECT value FROM json_each(?)) "
+                                  "GROUP BY wallet_address")
+        for table, columns in SUMMARY_COLUMNS.items():
+            if self._has(table, "wallet", *columns):
+                statements[table] = (f"SELECT wallet, MAX(rowid) AS last_row, {', '.join(columns)} "
+                                     f'FROM "{table}" WHERE {matching} GROUP BY wallet')
+        if self._has("active_chains", "wallet", "chain"):
+            statements["active_chains"] = ("SELECT wallet, chain FROM active_chains WHERE chain IS NOT NULL "
+                                           f"AND {matching} GROUP BY wallet, chain ORDER BY MIN(rowid)")
+        column = next((c for c in ("wallet", "address") if self._has("wallets", c)), None)
+        if column:
+            statements["wallets"] = (f'SELECT DISTINCT "{column}" AS wallet FROM wallets '
+                                     f'WHERE "{column}" IN (SELECT value FROM json_each(?))')
+        return statements
+
+    def query(self, sql, wallets=()):
+        """``sql`` (or the name of a feature statement) as a DataFrame, keyed by ``_key`` if it has wallets.
+
+        ``?`` is bound to the normalized ``wallets`` as a JSON array.
+        """
+        sql = self.statements.get(sql, sql)
+        params = [json.dumps(list(dict.fromkeys(normalize_address(w) for w in wallets)))] if "?" in sql else []
+        frame = pd.read_sql_query(sql, self._connection(), params=params)
+        if "wallet" in frame.columns:
+            frame["_key"] = _address_keys(frame["wallet"])
+        return frame
+
+    def has_wallet(self, wallet_address):
+        """True if any table has rows for ``wallet_address`` (one index seek per table)."""
+        conn = self._connection()
+        wallet = normalize_address(wallet_address)
+        return any(conn.execute(f'SELECT 1 FROM "{table}" WHERE "{column}" = ? LIMIT 1', (wallet,)).fetchone()
+                   for table, column in self.wallet_columns.items())
+
+    def wallet_keys(self):
+        """Address keys of every wallet with rows in any table."""
+        keys = set()
+        for table, column in self.wallet_columns.items():
+            wallets = self.query(f'SELECT DISTINCT "{column}" AS wallet FROM "{table}" WHERE "{column}" IS NOT NULL')
+            keys.update(wallets["_key"])
+        return keys
+
+    def wallet_features(self, wallet_address):
+        """``WalletFeatures`` for a wallet in the database, as ``_compute_features`` builds them."""
+        conn = self._connection()
+        params = (json.dumps([normalize_address(wallet_address)]),)
+
+        def rows(name):
+            sql = self.statements.get(name)
+            return conn.execute(sql, params).fetchall() if sql else []
+
+        def number(value):
+            # NULL is how NaN was stored.
+            return float("nan") if value is None else float(value or 0)
+
+        features = {"address": wallet_address, "total_networth": 0, "native_balance": 0,
+                    "token_balance_usd": 0, "chain": "unknown", "token_ratio": 0}
+        for _, _, total, native, token_balance, chain in rows("networth"):
+            total, token_balance = number(total), number(token_balance)
+            features.update(total_networth=total, native_balance=number(native), token_balance_usd=token_balance,
+                            chain=chain or "unknown", token_ratio=token_balance / max(float(total or 1), 1))
+
+        features.update(dict.fromkeys(STATS_COLUMNS.values(), 0))
+        for _, *totals in rows("stats"):
+            features.update(zip(STATS_COLUMNS.values(), map(int, totals)))
+
+        features["token_count"] = sum(count for _, count in rows("token_count"))
+        features["top_tokens"] = [symbol for _, symbol in rows("top_tokens")]
+        for _, _, count in rows("token_summary"):
+            features["token_count"] = int(count)
+
+        features["defi_protocols"], features["total_defi_usd"] = 0, 0.0
+        for _, protocols, total in rows("defi"):
+            features["defi_protocols"], features["total_defi_usd"] = int(protocols), float(total)
+        for _, _, protocols, total in rows("defi_summary"):
+            features["defi_protocols"], features["total_defi_usd"] = int(protocols), float(total)
+
+        features["unique_nft_collections"] = features["nft_collections"]
+        for _, collections in rows("nfts"):
+            features["unique_nft_collections"] = int(collections)
+        for _, _, collections in rows("nft_summary"):
+            features["unique_nft_collections"] = int(collections)
+
+        features["active_chains"] = [chain for _, chain in rows("active_chains")]
+        features["in_wallets_list"] = bool(rows("wallets"))
+        return _scored_record(features, self.cohort)
+
+    def _summary_override(self, out, table, column, wallets, dtype="int64"):
+        """``out[column]`` with the latest value from summary ``table`` for wallets that have one."""
+        if table not in self.statements:
+            return out[column]
+        latest = self.query(table, wallets).set_index("_key")[column]
+        return out["_key"].map(latest).fillna(out[column]).astype(dtype)
+
+    def batch_features(self, addresses):
+        """The table-derived columns of ``extract_features_batch``, one SQL query per feature group."""
+        out = pd.DataFrame({"address": list(addresses)})
+        out["_key"] = _address_keys(out["address"])
+        wallets = list(dict.fromkeys(out["address"]))
+
+        # --- Networth (balances summed over each wallet's chain rows) ---
+        networth_defaults = {"total_networth": 0.0, "native_balance": 0.0,
+                             "token_balance_usd": 0.0, "chain": "unknown"}
+        if "networth" in self.statements:
+            first = self.query("networth", wallets)
+            first = pd.DataFrame({
+                "_key": first["_key"],
+                "total_networth": first["total_networth_usd"].astype(float),
+                "native_balance": first["native_balance"].astype(float),
+                "token_balance_usd": first["token_balance_usd"].astype(float),
+                "chain": first["chain"].where(first["chain"] != "", "unknown"),
+            })
+            first["token_ratio"] = first["token_balance_usd"] / np.maximum(first["total_networth"], 1)
+            out = _merge_wallet_frame(out, first, {**networth_defaults, "token_ratio": 0.0})
+        else:
+            out = out.assign(**networth_defaults, token_ratio=0.0)
+
+        # --- Wallet Stats (summed per wallet) ---
+        stats_names = list(STATS_COLUMNS.values())
+        if "stats" in self.statements:
+            summed = self.query("stats", wallets).drop(columns="wallet")
+            out = _merge_wallet_frame(out, summed, dict.fromkeys(stats_names, 0))
+            out[stats_names] = out[stats_names].astype("int64")
+        else:
+            out = out.assign(**dict.fromkeys(stats_names, 0))
+
+        # --- Token Balances ---
+        out["token_count"] = 0
+        out["top_tokens"] = [[] for _ in range(len(out))]
+        if "token_count" in self.statements:
+            counts = self.query("token_count", wallets).set_index("_key")["token_count"]
+            out["token_count"] = out["_key"].map(counts).fillna(0).astype("int64")
+        if "top_tokens" in self.statements:
+            top = self.query("top_tokens", wallets).groupby("_key", sort=False)["token_symbol"].agg(list)
+            out["top_tokens"] = [v if isinstance(v, list) else [] for v in out["_key"].map(top)]
+        out["token_count"] = self._summary_override(out, "token_summary", "token_count", wallets)
+
+        # --- DeFi Positions ---
+        out["defi_protocols"] = 0
+        out["total_defi_usd"] = 0.0
+        if "defi" in self.statements:
+            grouped = self.query("defi", wallets).set_index("_key")
+            out["defi_protocols"] = out["_key"].map(grouped["defi_protocols"]).fillna(0).astype("int64")
+            out["total_defi_usd"] = out["_key"].map(grouped["total_defi_usd"]).fillna(0.0).astype(float)
+        out["defi_protocols"] = self._summary_override(out, "defi_summary", "defi_protocols", wallets)
+        out["total_defi_usd"] = self._summary_override(out, "defi_summary", "total_defi_usd", wallets, "float64")
+
+        # --- NFT Collections (from cleaned NFT file) ---
+        out["unique_nft_collections"] = out["nft_collections"]
+        if "nfts" in self.statements:
+            unique = self.query("nfts", wallets).set_index("_key")["collections"]
+            out["unique_nft_collections"] = out["_key"].map(unique).fillna(out["nft_collections"]).astype("int64")
+        out["unique_nft_collections"] = self._summary_override(out, "nft_summary", "unique_nft_collections", wallets)
+
+        # --- Active Chains (first-seen order) ---
+        out["active_chains"] = [[] for _ in range(len(out))]
+        if "active_chains" in self.statements:
+            chains = self.query("active_chains", wallets).groupby("_key", sort=False)["chain"].agg(list)
+            out["active_chains"] = [v if isinstance(v, list) else [] for v in out["_key"].map(chains)]
+
+        # --- Wallets List ---
+        out["in_wallets_list"] = False
+        if "wallets" in self.statements:
+            out["in_wallets_list"] = out["_key"].isin(self.query("wallets", wallets)["_key"])
+
+        out["activity_score"] = out["transactions_total"] + out["nft_transfers_total"] + out["token_transfers_total"]
+        return out
+
+
 # Helper functions for added features:
 
 def generate_social_handle(wallet_address):
@@ -368,8 +2298,11 @@ def generate_recommendations(features, classifications):
     return recs
 
 
-def generate_persona_profile(features, classifications):
-    """Generate a detailed persona profile text based on features and classifications."""
+def generate_persona_profile(features, classifications, recommendations=None):
+    """Generate a detailed persona profile text based on features and classifications.
+
+    Pass ``recommendations`` when they are already computed to avoid rebuilding them.
+    """
 
     handle = features.get("social_handle", "CryptoUser")
     networth = features.get("total_networth", 0)
@@ -420,7 +2353,7 @@ def generate_persona_profile(features, classifications):
     blockchain_pref = f"Primarily active on the {chain} blockchain, leveraging its ecosystem for opportunities."
 
     # Recommendations (build dynamically from generate_recommendations)
-    recs = generate_recommendations(features, classifications)
+    recs = recommendations if recommendations is not None else generate_recommendations(features, classifications)
     recs_text = "\n".join([f"- {r}" for r in recs])
 
     # Compose markdown persona profile
@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from caching import TTLCache
+from dataLoading import (
+    WalletFeatureTable, extract_features_batch, extract_wallet_features, load_env, load_wallet_store,
+    normalize_address, open_wallet_db,
+)
+from tracing import REGISTRY, span
+from wallet_persona_ai import get_generator
+
+
+def settings():
+    """Server settings from the environment (and a ``.env`` file), read at startup."""
+    load_env()
+    return {
+        "data_dir": os.getenv("WALLET_DATA_DIR", "data"),
+        # Query an indexed SQLite copy of the tables instead of holding them in memory.
+        "use_sqlite": os.getenv("WALLET_SQLITE", "0") == "1",
+        # Feature work is mostly quick local lookups but can block on the Moralis API for unknown wallets.
+        "feature_workers": int(os.getenv("SERVER_FEATURE_WORKERS", "8")),
+        "feature_max_pending": int(os.getenv("SERVER_FEATURE_MAX_PENDING", "64")),
+        # One model instance serves every request, so generation runs one batch at a time.
+        "llm_workers": int(os.getenv("SERVER_LLM_WORKERS", "1")),
+        "llm_max_pending": int(os.getenv("SERVER_LLM_MAX_PENDING", "8")),
+        "max_batch": int(os.getenv("SERVER_MAX_BATCH", "1000")),
+        "persona_warmup": os.getenv("PERSONA_WARMUP", "0") == "1",
+    }
+
+
+class BoundedExecutor:
+    """A thread pool that refuses work (HTTP 429) once ``max_pending`` jobs are queued or running.
+
+    Only touched from the event loop, so the pending counter needs no lock.
+    """
+
+    def __init__(self, workers, max_pending, name):
+        self.max_pending = max_pending
+        self.name = name
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    async def run(self, func, *args, **kwargs):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail=f"{self.name} queue is full, retry later",
+                                headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {"pending": self.pending, "max_pending": self.max_pending, "rejected": self.rejected}
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one computation.
+
+    Every caller awaits the same task; it is shielded so one client going
+    away does not cancel the work for the others.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.shared = 0
+
+    async def do(self, key, compute):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+
+class WalletBatch(BaseModel):
+    addresses: list[str]
+
+
+@asynccontextmanager
+async def lifespan(app):
+    state = app.state
+    # Read here rather than on import, so `uvicorn server:app` picks up a .env file too.
+    state.settings = config = settings()
+    data_dir = config["data_dir"]
+    # Tables are loaded and indexed once (or the database opened), then shared by every request.
+    state.store = open_wallet_db(data_dir) if config["use_sqlite"] else load_wallet_store(data_dir)
+    state.features = TTLCache(maxsize=4096, ttl=15 * 60)
+    state.feature_executor = BoundedExecutor(config["feature_workers"], config["feature_max_pending"], "features")
+    state.llm_executor = BoundedExecutor(config["llm_workers"], config["llm_max_pending"], "llm")
+    state.flights = SingleFlight()
+    state.generator = get_generator()
+    if config["persona_warmup"]:
+        state.generator.warm_up(background=True)
+    yield
+    state.feature_executor.shutdown()
+    state.llm_executor.shutdown()
+
+
+app = FastAPI(title="Onchain Wallet Persona API", lifespan=lifespan)
+
+
+def _check_address(address):
+    if not address.startswith("0x") or len(address) != 42:
+        raise HTTPException(status_code=400, detail="Invalid wallet address format (expected 0x... and 42 characters).")
+    return normalize_address(address)
+
+
+async def _wallet_features(state, address):
+    """Features for one wallet: cached, else computed once however many requests ask for it."""
+    key = _check_address(address)
+    cached = state.features.get(key)
+    if cached is not None:
+        return cached
+
+    async def compute():
+        try:
+            features = await state.feature_executor.run(extract_wallet_features, address, state.store)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        state.features.set(key, features)
+        return features
+
+    return await state.flights.do(("features", key), compute)
+
+
+@app.get("/wallet/{address}/features")
+async def wallet_features(address: str, request: Request):
+    with span("server.features"):
+        features = await _wallet_features(request.app.state, address)
+    return features.to_dict()
+
+
+@app.post("/wallets/features")
+async def wallets_features(batch: WalletBatch, request: Request):
+    """Features for many wallets.
+
+    Wallets in the local tables are computed together in one vectorized pass;
+    the rest go through the per-wallet path, which may call the Moralis API.
+    Both come back as the same records, without the free-text fields.
+    Failures, including malformed addresses, are reported per address.
+    """
+    state = request.app.state
+    max_batch = state.settings["max_batch"]
+    if len(batch.addresses) > max_batch:
+        raise HTTPException(status_code=413, detail=f"At most {max_batch} addresses per request.")
+    with span("server.batch_features"):
+        results, errors = {}, {}
+        local, remote = [], []
+        for address in dict.fromkeys(batch.addresses):
+            try:
+                key = _check_address(address)
+            except HTTPException as e:
+                errors[address] = e.detail
+                continue
+            (local if state.store.has_wallet(key) else remote).append(address)
+
+        if local:
+            frame = await state.feature_executor.run(extract_features_batch, local, state.store)
+            for record in WalletFeatureTable.from_frame(frame).to_dicts(text=False):
+                results[record["address"]] = record
+
+        async def one(address):
+            try:
+                results[address] = (await _wallet_features(state, address)).to_dict(text=False)
+            except HTTPException as e:
+                errors[address] = e.detail
+
+        await asyncio.gather(*(one(a) for a in remote))
+    return {"results": results, "errors": errors}
+
+
+@app.get("/wallet/{address}/persona")
+async def wallet_persona(address: str, request: Request, detailed: bool = True):
+    state = request.app.state
+    with span("server.persona"):
+        features = await _wallet_features(state, address)
+
+        async def compute():
+            return await state.llm_executor.run(state.generator.generate_persona, features, detailed)
+
+        persona = await state.flights.do(("persona", normalize_address(address), detailed), compute)
+    return {"address": address, "detailed": detailed, "persona": persona}
+
+
+@app.get("/healthz")
+async def healthz(request: Request):
+    state = request.app.state
+    return {
+        "model_loaded": state.generator.loaded,
+        "features_cache": state.features.stats(),
+        "feature_queue": state.feature_executor.stats(),
+        "llm_queue": state.llm_executor.stats(),
+        "single_flight_shared": state.flights.shared,
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return REGISTRY.to_prometheus()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve wallet features and personas over HTTP")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    args = parser.parse_args()
+    # A single worker process keeps one copy of the tables and the model.
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,126 +1,67 @@
-import pandas as pd
 import json
 import argparse
+import multiprocessing
+import time
 from pathlib import Path
-from dataLoading import load_wallet_data, extract_wallet_features, classify_wallet
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from huggingface_hub import login
-from visualization import generate_html_report
-
-
-class WalletPersonaGenerator:
-    def __init__(self, hf_token=None):
-        """Initialize with the Mistral-7B-Instruct-v0.2 model
-        
-        Args:
-            hf_token: Hugging Face API token for authentication (optional for this model)
-        """
-        if hf_token:
-            login(token=hf_token, write_permission=False)
-
-        try:
-            print("Loading Mistral model pipeline...")
-            model_id = "mistralai/Mistral-7B-Instruct-v0.2"
-            self.tokenizer = AutoTokenizer.from_pretrained(model_id)
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_id,
-                device_map="auto",
-                torch_dtype="auto"
-            )
-            print("Model loaded successfully")
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            raise
-
-    def generate_persona(self, wallet_data, detailed=True):
-        """Generate a persona using Mistral-7B model."""
-        classifications = wallet_data.get('classifications', [])
-        short_addr = f"{wallet_data['address'][:6]}...{wallet_data['address'][-4:]}"
-        
-        if detailed:
-            content = (
-                f"Generate a detailed persona profile for crypto wallet {short_addr} based on the following on-chain data:\n"
-                f"- Total networth: ${wallet_data.get('total_networth', 0):,.2f}\n"
-                f"- Native balance: {wallet_data.get('native_balance', 0):,.2f}\n"
-                f"- Token balance: ${wallet_data.get('token_balance_usd', 0):,.2f}\n"
-                f"- Chain: {wallet_data.get('chain', 'unknown')}\n"
-                f"- Wallet Health Score: {wallet_data.get('wallet_health_score', 0)} / 100\n"
-                f"- Risk Score: {wallet_data.get('risk_score', 0)} / 100 (higher means riskier)\n"
-                f"- Activity Score: {wallet_data.get('activity_score', 0)} (aggregate transaction count)\n"
-                f"- Token Count: {wallet_data.get('token_count', 0)} tokens held\n"
-                f"- Top Tokens: {', '.join(wallet_data.get('top_tokens', [])) or 'None'}\n"
-                f"- DeFi Protocols: {wallet_data.get('defi_protocols', 0)} engaged\n"
-                f"- Total DeFi USD: ${wallet_data.get('total_defi_usd', 0):,.2f}\n"
-                f"- NFT Collections: {wallet_data.get('unique_nft_collections', 0)}\n"
-                f"- Classifications: {', '.join(classifications) if classifications else 'None'}\n"
-                f"- Social Handle: {wallet_data.get('social_handle', 'N/A')}\n"
-                f"\nFictional Persona Journey:\n{wallet_data.get('persona_journey', '')}\n\n"
-                f"Based on these, create a rich, fictional persona including:\n"
-                f"1. Crypto Identity: Who they are in the crypto ecosystem\n"
-                f"2. Trading Style: Their approach, time horizon, transaction patterns\n"
-                f"3. Risk Profile: Their comfort with different types of risk\n"
-                f"4. Blockchain Preferences: Why they choose this chain\n"
-                f"5. Personalized Recommendations: 3-4 specific products or strategies\n\n"
-                f"Format your response as a well-structured markdown document with headers for each section."
-            )
-        else:
-            content = (
-                f"Create a brief crypto persona for wallet {short_addr} with "
-                f"${wallet_data.get('total_networth', 0):,.2f} total worth on {wallet_data.get('chain', 'unknown')} chain. "
-                f"Include identity type, risk profile, and 1-2 recommendations."
-            )
-
-        messages = [{"role": "user", "content": content}]
-        print("Generating response with Mistral model...")
-
-        max_new_tokens = 800 if detailed else 300
-
-        input_ids = self.tokenizer.apply_chat_template(
-            messages,
-            return_tensors="pt"
-        ).to(self.model.device)
-
-        # Robust attention_mask and pad_token_id handling
-        pad_token_id = self.tokenizer.pad_token_id
-        if pad_token_id is None:
-            pad_token_id = self.tokenizer.eos_token_id
-        attention_mask = (input_ids != pad_token_id).long()
-        generated_ids = self.model.generate(
-            input_ids,
-            attention_mask=attention_mask,
-            max_new_tokens=max_new_tokens,
-            temperature=0.7,
-            top_p=0.9,
-            do_sample=True,
-            pad_token_id=pad_token_id
-        )
-
-        generated_text = self.tokenizer.decode(generated_ids[0], skip_special_tokens=True)
-
-        user_content = messages[-1]["content"]
-
-        if user_content in generated_text:
-            response_start = generated_text.find(user_content) + len(user_content)
-            response_text = generated_text[response_start:].strip()
-            response_text = response_text.replace("[/INST]", "").strip()
-        else:
-            response_text = generated_text.strip()
-
-        return response_text
+from dataLoading import (
+    TokenBucket, api_cu_per_second, extract_wallet_features, load_env, load_wallet_store, open_wallet_db,
+    read_wallet_list, set_api_limiter,
+)
+from tracing import REGISTRY, profile_request
+from wallet_persona_ai import BACKENDS, get_generator
 
 
 def main():
+    load_env()
     parser = argparse.ArgumentParser(description="Generate crypto wallet personas")
-    parser.add_argument("--wallet", type=str, required=True, help="Wallet address to analyze")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--wallet", type=str, help="Wallet address to analyze")
+    target.add_argument("--wallets-file", type=str, help="CSV/TXT of wallet addresses to score in batch mode")
     parser.add_argument("--data-dir", type=str, default="data", help="Directory with wallet data")
+    parser.add_argument("--memory-budget-mb", type=float,
+                        help="Stream the token, NFT and DeFi tables within this memory budget")
+    parser.add_argument("--sqlite", action="store_true",
+                        help="Query an indexed SQLite copy of the tables instead of loading them")
     parser.add_argument("--hf-token", type=str, help="Hugging Face access token (optional)")
+    parser.add_argument("--model", type=str,
+                        help="Hugging Face model id or local path (default: PERSONA_MODEL_ID or Mistral-7B)")
+    parser.add_argument("--backend", type=str, choices=list(BACKENDS),
+                        help="Inference backend (default: PERSONA_BACKEND or hf; int8 and llamacpp run quantized on CPU)")
     parser.add_argument("--simple", action="store_true", help="Generate simple persona instead of detailed")
+    parser.add_argument("--no-stream", action="store_true", help="Print the persona only once it is complete")
     parser.add_argument("--json-output", action="store_true", help="Save persona data as JSON as well")
     parser.add_argument("--html-output", action="store_true", help="Generate interactive HTML report")
+    parser.add_argument("--workers", type=int, default=1, help="Processes computing features in batch mode")
+    parser.add_argument("--output", type=str, default="personas.jsonl",
+                        help="Batch mode output file (.jsonl or .parquet)")
+    parser.add_argument("--personas", action="store_true", help="Also generate LLM personas in batch mode")
+    parser.add_argument("--timings", action="store_true", help="Print per-stage timings as JSON lines")
     args = parser.parse_args()
 
+    with profile_request("cli"):
+        if args.wallets_file:
+            run_batch(args)
+        else:
+            run(args)
+
+    if args.timings:
+        print(REGISTRY.to_json_lines())
+
+
+def load_tables(data_dir, memory_budget_mb=None, sqlite=False):
+    """The wallet tables indexed in memory, or with ``sqlite`` the on-disk database (built if stale)."""
+    if sqlite:
+        return open_wallet_db(data_dir, memory_budget_mb=memory_budget_mb)
+    return load_wallet_store(data_dir, memory_budget_mb=memory_budget_mb)
+
+
+def run(args):
+    # Load the model in the background while the wallet data is read and analysed.
+    generator = get_generator(hf_token=args.hf_token, model_id=args.model, backend=args.backend)
+    generator.warm_up(background=True)
+
     print(f"Loading data from {args.data_dir}...")
-    data_dict = load_wallet_data(args.data_dir)
+    data_dict = load_tables(args.data_dir, args.memory_budget_mb, args.sqlite)
 
     print(f"Analyzing wallet {args.wallet}...")
     features = extract_wallet_features(args.wallet, data_dict)
@@ -129,16 +70,22 @@ def main():
         print(f"No data found for wallet {args.wallet}")
         return
 
-    features['classifications'] = classify_wallet(features)
-
-    generator = WalletPersonaGenerator(hf_token=args.hf_token)
     print("Generating persona...")
-    persona_md = generator.generate_persona(features, detailed=not args.simple)
+    if args.no_stream:
+        persona_md = generator.generate_persona(features, detailed=not args.simple)
 
     print("\n" + "=" * 50)
     print("WALLET PERSONA")
     print("=" * 50)
-    print(persona_md)
+    if args.no_stream:
+        print(persona_md)
+    else:
+        chunks = []
+        for chunk in generator.stream_persona(features, detailed=not args.simple):
+            print(chunk, end="", flush=True)
+            chunks.append(chunk)
+        print()
+        persona_md = "".join(chunks).strip()
     print("=" * 50)
 
     output_md_file = f"persona_{args.wallet[:8]}.md"
@@ -150,12 +97,137 @@ def main():
     if args.json_output:
         output_json_file = f"persona_{args.wallet[:8]}.json"
         with open(output_json_file, "w") as f:
-            json.dump(features, f, indent=2)
+            json.dump(features.to_dict(), f, indent=2)
         print(f"Raw persona data saved to {output_json_file}")
 
     if args.html_output:
+        from visualization import generate_html_report
         output_html_file = f"persona_report_{args.wallet[:8]}.html"
         generate_html_report(features, persona_md, output_html_file)
 
+
+# Set in the parent before the worker pool forks, so workers share the loaded tables copy-on-write.
+_store = None
+BATCH_CHUNK_SIZE = 256
+
+
+def _init_worker(workers, data_dir=None, memory_budget_mb=None, sqlite=False):
+    """Give a worker its share of the Moralis budget, and load the tables where fork is unavailable.
+
+    Each process rate-limits its own live fetches, so ``workers`` processes
+    split ``MORALIS_CU_PER_SECOND`` between them rather than each spending it.
+    """
+    global _store
+    set_api_limiter(TokenBucket(api_cu_per_second() / workers))
+    if data_dir is not None:
+        _store = load_tables(data_dir, memory_budget_mb, sqlite)
+
+
+def _score_chunk(addresses):
+    """Feature records (or errors) for a chunk of wallets, computed against ``_store``."""
+    records = []
+    for address in addresses:
+        try:
+            records.append(extract_wallet_features(address, _store).to_dict())
+        except Exception as e:
+            records.append({"address": address, "error": str(e)})
+    return records
+
+
+# Parquet column types, declared up front: a chunk where a column is all null or all
+# empty lists (``error``, ``active_chains``) would otherwise fix it as a null type.
+PARQUET_COLUMNS = {
+    "address": "string", "total_networth": "double", "native_balance": "double", "token_balance_usd": "double",
+    "chain": "string", "token_ratio": "double", "transactions_total": "int64", "nft_transfers_total": "int64",
+    "token_transfers_total": "int64", "nft_count": "int64", "nft_collections": "int64", "token_count": "int64",
+    "top_tokens": "strings", "defi_protocols": "int64", "total_defi_usd": "double",
+    "unique_nft_collections": "int64", "active_chains": "strings", "in_wallets_list": "bool",
+    "activity_score": "int64", "wallet_health_score": "double", "risk_score": "double",
+    "social_handle": "string", "classifications": "strings", "recommendations": "strings",
+    "persona_profile": "string", "persona": "string", "error": "string",
+}
+
+
+class ResultWriter:
+    """Streams records to one JSON-lines file, or to Parquet when the path ends in ``.parquet``."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.parquet = self.path.suffix == ".parquet"
+        self._writer = None
+        self._file = None if self.parquet else open(self.path, "w")
+
+    def write(self, records):
+        if not self.parquet:
+            for record in records:
+                self._file.write(json.dumps(record, default=str) + "\n")
+            self._file.flush()
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self._writer is None:
+            types = {"string": pa.string(), "double": pa.float64(), "int64": pa.int64(), "bool": pa.bool_(),
+                     "strings": pa.list_(pa.string())}
+            schema = pa.schema([(name, types[kind]) for name, kind in PARQUET_COLUMNS.items()])
+            self._writer = pq.ParquetWriter(self.path, schema)
+        self._writer.write_table(pa.Table.from_pylist(records, schema=self._writer.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def run_batch(args):
+    """Score every wallet in ``--wallets-file`` into a single output file."""
+    global _store
+    wallets = read_wallet_list(args.wallets_file)
+    print(f"Loading data from {args.data_dir}...")
+    _store = load_tables(args.data_dir, args.memory_budget_mb, args.sqlite)
+    chunks = [wallets[i:i + BATCH_CHUNK_SIZE] for i in range(0, len(wallets), BATCH_CHUNK_SIZE)]
+    print(f"Scoring {len(wallets)} wallets with {args.workers} worker(s) into {args.output}...")
+
+    pool = None
+    if args.workers > 1:
+        if "fork" in multiprocessing.get_all_start_methods():
+            pool = multiprocessing.get_context("fork").Pool(args.workers, initializer=_init_worker,
+                                                            initargs=(args.workers,))
+        else:
+            pool = multiprocessing.Pool(args.workers, initializer=_init_worker,
+                                        initargs=(args.workers, args.data_dir, args.memory_budget_mb, args.sqlite))
+    results = pool.imap(_score_chunk, chunks) if pool else map(_score_chunk, chunks)
+
+    generator = None
+    if args.personas:
+        # Started only after the fork so no worker inherits a half-loaded model thread.
+        generator = get_generator(hf_token=args.hf_token, model_id=args.model, backend=args.backend)
+        generator.warm_up(background=True)
+
+    writer = ResultWriter(args.output)
+    done = failed = 0
+    start = time.monotonic()
+    try:
+        for records in results:
+            if generator is not None:
+                scored = [r for r in records if "error" not in r]
+                for record, persona in zip(scored, generator.generate_personas(scored, detailed=not args.simple)):
+                    record["persona"] = persona
+            writer.write(records)
+            done += len(records)
+            failed += sum("error" in r for r in records)
+            rate = done / (time.monotonic() - start)
+            print(f"{done}/{len(wallets)} wallets scored ({rate:.1f} wallets/sec)")
+    finally:
+        writer.close()
+        if pool:
+            pool.close()
+            pool.join()
+
+    elapsed = time.monotonic() - start
+    print(f"Done: {done - failed} scored, {failed} failed in {elapsed:.1f}s "
+          f"({done / max(elapsed, 1e-9):.1f} wallets/sec); results saved to {args.output}")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+from backfill import RetryingApi
+from caching import CachingApi, ResponseCache
+from dataLoading import RateLimitedApi
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.spent = 0
+
+    def acquire(self, cost=1):
+        self.spent += cost
+
+
+def test_wrappers_compose_per_endpoint_call(tmp_path):
+    calls = []
+
+    def get_wallet_stats(api_key=None, params=None):
+        calls.append(params["chain"])
+        if len(calls) == 1:
+            raise RuntimeError("rate limited")
+        return {"chain": params["chain"]}
+
+    limiter = CountingLimiter()
+    api = SimpleNamespace(wallets=SimpleNamespace(get_wallet_stats=get_wallet_stats))
+    api = RateLimitedApi(api, limiter, {"wallets.get_wallet_stats": 50})
+    api = CachingApi(RetryingApi(api, retries=1, backoff=0), ResponseCache(tmp_path / "responses.sqlite"))
+
+    for _ in range(2):
+        assert api.wallets.get_wallet_stats(api_key="key", params={"chain": "eth"}) == {"chain": "eth"}
+
+    # The failed attempt is retried and both attempts are charged; the repeat is served from the cache.
+    assert calls == ["eth", "eth"]
+    assert limiter.spent == 100
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from backfill import backfill
+from dataLoading import DATA_FILES, LISTING_ROWS_KEPT, extract_wallet_features, load_wallet_data
+
+WALLET = "0x" + "2" * 40
+
+
+def paged(build, rows):
+    """A cursor-paginated stub endpoint returning ``rows`` entries in all."""
+    def endpoint(api_key=None, params=None):
+        start = int(params.get("cursor") or 0)
+        end = min(start + params["limit"], rows)
+        return {"result": [build(i) for i in range(start, end)], "cursor": str(end) if end < rows else None}
+    return endpoint
+
+
+def stub_api(tokens, collections):
+    return SimpleNamespace(
+        wallets=SimpleNamespace(
+            get_wallet_token_balances_price=paged(lambda i: {"symbol": f"T{i}", "usd_value": i}, tokens),
+            get_wallet_net_worth=lambda api_key=None, params=None: {
+                "total_networth_usd": "100",
+                "chains": [{"chain": "eth", "native_balance_formatted": "1", "token_balance_usd": "90",
+                            "networth_usd": "100"}],
+            },
+            get_wallet_stats=lambda api_key=None, params=None: {
+                "nfts": "1", "collections": "1", "transactions": {"total": "3"},
+                "nft_transfers": {"total": "0"}, "token_transfers": {"total": "0"},
+            },
+        ),
+        nft=SimpleNamespace(
+            get_wallet_nft_collections=paged(lambda i: {"token_address": f"0x{i:040x}"}, collections),
+        ),
+    )
+
+
+def test_backfill_writes_whole_listings(tmp_path):
+    tokens, collections = 3 * LISTING_ROWS_KEPT + 5, 2 * LISTING_ROWS_KEPT + 1
+    written, failed = backfill([WALLET], data_dir=tmp_path, concurrency=1, retries=0,
+                               api=stub_api(tokens, collections), chains=("eth",))
+
+    assert (written, failed) == ([WALLET], [])
+    token_rows = pd.read_csv(tmp_path / DATA_FILES["tokens"])
+    assert len(token_rows) == tokens
+    assert set(token_rows["token_symbol"]) == {f"T{i}" for i in range(tokens)}
+    assert len(pd.read_csv(tmp_path / DATA_FILES["nfts"])) == collections
+
+    features = extract_wallet_features(WALLET, load_wallet_data(tmp_path))
+    assert features["token_count"] == tokens
+    assert features["unique_nft_collections"] == collections
+    assert features["top_tokens"] == [f"T{tokens - 1}", f"T{tokens - 2}", f"T{tokens - 3}"]
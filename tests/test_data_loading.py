@@ -0,0 +1,23 @@
+import pandas as pd
+import pytest
+
+from dataLoading import DATA_FILES, load_wallet_data
+
+
+def test_mixed_type_column_loads_without_cache(tmp_path):
+    pytest.importorskip("pyarrow")
+    # Past pandas' first low-memory chunk of rows the column turns to strings,
+    # so it is read as mixed ints and strs, which Arrow cannot convert.
+    rows = 262_145
+    protocol_ids = [str(i) for i in range(rows)]
+    protocol_ids[-1] = "uniswap-v2"
+    pd.DataFrame({
+        "wallet": ["0x" + "a" * 40] * rows,
+        "protocol_id": protocol_ids,
+        "usd_value": 1.0,
+    }).to_csv(tmp_path / DATA_FILES["defi"], index=False)
+
+    data = load_wallet_data(tmp_path, use_cache=True)
+
+    assert len(data["defi"]) == rows
+    assert data["defi"]["protocol_id"].iloc[-1] == "uniswap-v2"
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from dataLoading import (
+    DATA_FILES, extract_features_batch, extract_wallet_features, load_wallet_data, load_wallet_store,
+    open_wallet_db,
+)
+
+WALLET = "0x" + "1" * 40
+NETWORTH_KEYS = ("total_networth", "native_balance", "token_balance_usd", "chain", "token_ratio")
+
+
+@pytest.fixture
+def multichain_dir(tmp_path):
+    pd.DataFrame({
+        "wallet": [WALLET, WALLET],
+        "chain": ["eth", "polygon"],
+        "native_balance": [1.0, 2000.0],
+        "token_balance_usd": [50.0, 900.0],
+        "chain_networth_usd": [100.0, 900.0],
+        "total_networth_usd": [1000.0, 1000.0],
+    }).to_csv(tmp_path / DATA_FILES["networth"], index=False)
+    pd.DataFrame({
+        "wallet": [WALLET, WALLET],
+        "transactions_total": [10, 5],
+        "nft_transfers_total": [0, 0],
+        "token_transfers_total": [0, 0],
+        "chain": ["eth", "polygon"],
+    }).to_csv(tmp_path / DATA_FILES["stats"], index=False)
+    return tmp_path
+
+
+def test_networth_is_combined_across_chain_rows(multichain_dir):
+    features = extract_wallet_features(WALLET, load_wallet_data(multichain_dir))
+
+    assert features["total_networth"] == 1000.0
+    assert features["token_balance_usd"] == 950.0
+    assert features["token_ratio"] == pytest.approx(0.95)
+    # The chain and its native balance come from the chain holding most of the net worth.
+    assert features["chain"] == "polygon"
+    assert features["native_balance"] == 2000.0
+
+
+def test_networth_paths_agree(multichain_dir):
+    data = load_wallet_data(multichain_dir)
+    expected = {key: extract_wallet_features(WALLET, data)[key] for key in NETWORTH_KEYS}
+
+    store = load_wallet_store(multichain_dir)
+    db = open_wallet_db(multichain_dir)
+    try:
+        results = [
+            extract_wallet_features(WALLET, store),
+            extract_features_batch([WALLET], data).iloc[0],
+            extract_wallet_features(WALLET, db),
+            extract_features_batch([WALLET], db).iloc[0],
+        ]
+    finally:
+        db.close()
+    for result in results:
+        assert {key: result[key] for key in NETWORTH_KEYS} == pytest.approx(expected)
@@ -0,0 +1,159 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+# Set to "cprofile" (or "1") / "pyinstrument" to profile each request wrapped in profile_request().
+PROFILE_ENV = "WALLET_PROFILE"
+# Where profiles go unless WALLET_PROFILE_DIR says otherwise (read per request).
+PROFILE_DIR = "profiles"
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Durations of one stage: exact count/sum plus a bounded window of recent samples.
+
+    Percentiles are computed over the most recent ``window`` samples, which
+    keeps memory flat for long-running processes.
+    """
+
+    def __init__(self, window=10_000):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.samples.append(seconds)
+
+    def quantiles(self, qs=QUANTILES):
+        if not self.samples:
+            return {q: 0.0 for q in qs}
+        values = np.quantile(np.fromiter(self.samples, dtype=float), qs)
+        return dict(zip(qs, values.tolist()))
+
+
+class Registry:
+    """Thread-safe collection of stage histograms keyed by span name."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self):
+        """Per-stage count, total and p50/p95/p99 in seconds."""
+        with self._lock:
+            items = list(self._histograms.items())
+        stats = {}
+        for name, histogram in sorted(items):
+            quantiles = histogram.quantiles()
+            stats[name] = {
+                "count": histogram.count,
+                "sum": histogram.total,
+                "p50": quantiles[0.5],
+                "p95": quantiles[0.95],
+                "p99": quantiles[0.99],
+            }
+        return stats
+
+    def to_json_lines(self):
+        """One JSON object per stage."""
+        return "\n".join(json.dumps({"stage": name, **stats}) for name, stats in self.snapshot().items())
+
+    def to_prometheus(self, metric="wallet_stage_duration_seconds"):
+        """Prometheus text exposition format, one summary series per stage."""
+        lines = [
+            f"# HELP {metric} Duration of persona pipeline stages.",
+            f"# TYPE {metric} summary",
+        ]
+        for name, stats in self.snapshot().items():
+            for q in QUANTILES:
+                lines.append(f'{metric}{{stage="{name}",quantile="{q}"}} {stats[f"p{int(q * 100)}"]}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {stats["sum"]}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+@contextmanager
+def span(name, registry=None):
+    """Time the enclosed block and record it under ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        (registry or REGISTRY).observe(name, time.perf_counter() - start)
+
+
+def traced(name=None):
+    """Decorator form of ``span``; defaults to the function's qualified name."""
+    def decorator(func):
+        stage = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile_request(label="request"):
+    """Profile the enclosed request when ``WALLET_PROFILE`` is set; otherwise a no-op.
+
+    ``cprofile`` (or ``1``) writes a ``.prof`` file readable with ``pstats`` or
+    snakeviz; ``pyinstrument`` writes an HTML report. Files go to
+    ``WALLET_PROFILE_DIR`` (default ``profiles/``).
+    """
+    mode = os.getenv(PROFILE_ENV, "").lower()
+    if not mode or mode == "0":
+        yield
+        return
+
+    out_dir = Path(os.getenv("WALLET_PROFILE_DIR", PROFILE_DIR))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stem = out_dir / f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    if mode == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path = stem.with_suffix(".html")
+            path.write_text(profiler.output_html())
+            print(f"Profile saved to {path}")
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path = stem.with_suffix(".prof")
+            profiler.dump_stats(path)
+            print(f"Profile saved to {path}")
@@ -1,106 +1,439 @@
-import pandas as pd
-import json
-from dataLoading import load_wallet_data, extract_wallet_features, classify_wallet
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from huggingface_hub import login
+import os
+import threading
+import time
+from caching import ResponseCache
+from tracing import REGISTRY, span, traced
+
+# Defaults when PERSONA_MODEL_ID, PERSONA_BACKEND and PERSONA_CACHE_PATH are unset; the
+# environment is read when a generator is created, not on import.
+DEFAULT_MODEL_ID = "mistralai/Mistral-7B-Instruct-v0.2"
+# "hf" (full precision), "int8" (dynamically quantized, CPU) or "llamacpp" (GGUF file as PERSONA_MODEL_ID).
+DEFAULT_BACKEND = "hf"
+
+# Generated personas are cached on disk keyed by (prompt, backend, model_id, generation params);
+# the chat template is fixed per model, so the raw prompt is enough.
+PERSONA_CACHE_PATH = os.path.join("data", ".cache", "persona_outputs.sqlite")
+PERSONA_CACHE_TTL = 30 * 24 * 3600
+PERSONA_BATCH_SIZE = 4
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def build_persona_prompt(wallet_data, detailed=True):
+    """The user message sent to the model for one wallet's feature dict."""
+    classifications = wallet_data.get('classifications', [])
+    short_addr = f"{wallet_data['address'][:6]}...{wallet_data['address'][-4:]}"
+
+    if detailed:
+        return (
+            f"Generate a detailed persona profile for crypto wallet {short_addr} based on the following on-chain data:\n"
+            f"- Total networth: ${wallet_data.get('total_networth', 0):,.2f}\n"
+            f"- Native balance: {wallet_data.get('native_balance', 0):,.2f}\n"
+            f"- Token balance: ${wallet_data.get('token_balance_usd', 0):,.2f}\n"
+            f"- Chain: {wallet_data.get('chain', 'unknown')}\n"
+            f"- Wallet Health Score: {wallet_data.get('wallet_health_score', 0)} / 100\n"
+            f"- Risk Score: {wallet_data.get('risk_score', 0)} / 100 (higher means riskier)\n"
+            f"- Activity Score: {wallet_data.get('activity_score', 0)} (aggregate transaction count)\n"
+            f"- Token Count: {wallet_data.get('token_count', 0)} tokens held\n"
+            f"- Top Tokens: {', '.join(wallet_data.get('top_tokens', [])) or 'None'}\n"
+            f"- DeFi Protocols: {wallet_data.get('defi_protocols', 0)} engaged\n"
+            f"- Total DeFi USD: ${wallet_data.get('total_defi_usd', 0):,.2f}\n"
+            f"- NFT Collections: {wallet_data.get('unique_nft_collections', 0)}\n"
+            f"- Classifications: {', '.join(classifications) if classifications else 'None'}\n"
+            f"- Social Handle: {wallet_data.get('social_handle', 'N/A')}\n"
+            f"\nFictional Persona Journey:\n{wallet_data.get('persona_journey', '')}\n\n"
+            f"Based on these, create a rich, fictional persona including:\n"
+            f"1. Crypto Identity: Who they are in the crypto ecosystem\n"
+            f"2. Trading Style: Their approach, time horizon, transaction patterns\n"
+            f"3. Risk Profile: Their comfort with different types of risk\n"
+            f"4. Blockchain Preferences: Why they choose this chain\n"
+            f"5. Personalized Recommendations: 3-4 specific products or strategies\n\n"
+            f"Format your response as a well-structured markdown document with headers for each section."
+        )
+    return (
+        f"Create a brief crypto persona for wallet {short_addr} with "
+        f"${wallet_data.get('total_networth', 0):,.2f} total worth on {wallet_data.get('chain', 'unknown')} chain. "
+        f"Include identity type, risk profile, and 1-2 recommendations."
+    )
+
+
+class HFBackend:
+    """Full-precision Hugging Face ``transformers`` model, batched with left padding."""
+
+    name = "hf"
+    # Extra ``from_pretrained`` arguments for subclasses.
+    load_kwargs = {}
+
+    def __init__(self, model_id=DEFAULT_MODEL_ID, hf_token=None, device_map="auto", torch_dtype="auto"):
+        self.model_id = model_id
+        self.hf_token = hf_token
+        self.device_map = device_map
+        self.torch_dtype = torch_dtype
+        self.tokenizer = None
+        self.model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def load(self):
+        """Load the tokenizer and model once; concurrent callers wait for the first load."""
+        if self.model is not None:
+            return
+        with self._load_lock:
+            if self.model is not None:
+                return
+            # Imported here so data-only users of this module never pull in torch.
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+
+            if self.hf_token:
+                from huggingface_hub import login
+                login(token=self.hf_token, write_permission=False)
+
+            try:
+                print(f"Loading {self.model_id} model pipeline ({self.name})...")
+                with span("llm.load_model"):
+                    tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+                    model = self._prepare(AutoModelForCausalLM.from_pretrained(
+                        self.model_id,
+                        device_map=self.device_map,
+                        torch_dtype=self.torch_dtype,
+                        **self.load_kwargs
+                    ))
+                print("Model loaded successfully")
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                raise
+
+            # Decoder-only models need left padding so every prompt ends where generation starts.
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            self.tokenizer = tokenizer
+            self.model = model
+
+    def _prepare(self, model):
+        return model
+
+    def _chat_text(self, content):
+        """``content`` wrapped in the model's chat template, if it has one."""
+        if not self.tokenizer.chat_template:
+            return content
+        return self.tokenizer.apply_chat_template(
+            [{"role": "user", "content": content}],
+            tokenize=False,
+            add_generation_prompt=True
+        )
+
+    def _tokenize(self, prompts):
+        with span("llm.tokenize"):
+            return self.tokenizer(
+                [self._chat_text(p) for p in prompts],
+                return_tensors="pt",
+                padding=True,
+                # Chat templates already add the BOS token.
+                add_special_tokens=not self.tokenizer.chat_template
+            ).to(self.model.device)
+
+    def generate(self, prompts, params):
+        """Completions for a batch of prompts through one ``model.generate`` call."""
+        inputs = self._tokenize(prompts)
+        with span("llm.generate"):
+            generated_ids = self.model.generate(
+                inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                pad_token_id=self.tokenizer.pad_token_id,
+                **params
+            )
+
+        # Only decode the tokens generated after the (padded) prompt.
+        with span("llm.decode"):
+            new_ids = generated_ids[:, inputs["input_ids"].shape[1]:]
+            texts = self.tokenizer.batch_decode(new_ids, skip_special_tokens=True)
+        return [text.replace("[/INST]", "").strip() for text in texts]
+
+    def stream(self, prompt, params):
+        """Yield decoded text chunks for one prompt while it is generated.
+
+        Generation runs in a background thread feeding a ``TextIteratorStreamer``
+        that skips the prompt, so only new tokens are decoded.
+        """
+        from transformers import TextIteratorStreamer
+
+        inputs = self._tokenize([prompt])
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def generate():
+            try:
+                with span("llm.generate"):
+                    self.model.generate(
+                        inputs["input_ids"],
+                        attention_mask=inputs["attention_mask"],
+                        pad_token_id=self.tokenizer.pad_token_id,
+                        streamer=streamer,
+                        **params
+                    )
+            except Exception as e:
+                errors.append(e)
+                # Unblock the consumer; the error is re-raised below.
+                streamer.end()
+
+        thread = threading.Thread(target=generate, name="persona-generate", daemon=True)
+        thread.start()
+        for chunk in streamer:
+            if chunk:
+                yield chunk
+        thread.join()
+        if errors:
+            raise errors[0]
+
+
+class Int8Backend(HFBackend):
+    """The Hugging Face model with its Linear layers dynamically quantized to int8.
+
+    Runs on CPU only. Dynamic quantization needs float32 weights (bfloat16
+    layers around the int8 Linears fail at runtime), so the checkpoint is
+    streamed in at float32 without a second randomly initialised copy, then
+    each Linear is swapped for its int8 version in place. That roughly
+    quarters the resident Linear weights and speeds up matmuls on CPUs with
+    int8 support.
+    """
+
+    name = "int8"
+    load_kwargs = {"low_cpu_mem_usage": True}
+
+    def __init__(self, model_id=DEFAULT_MODEL_ID, hf_token=None, **kwargs):
+        super().__init__(model_id, hf_token=hf_token, device_map=None, torch_dtype="float32")
+
+    def _prepare(self, model):
+        import torch
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class LlamaCppBackend:
+    """A GGUF model (e.g. a Q4_K_M quantization) run by ``llama-cpp-python`` on CPU.
+
+    ``model_id`` is the path to the .gguf file. Prompts are generated one at
+    a time; llama.cpp applies the chat template stored in the GGUF file.
+    """
+
+    name = "llamacpp"
+
+    def __init__(self, model_id=DEFAULT_MODEL_ID, n_ctx=4096, n_threads=None, **kwargs):
+        self.model_id = model_id
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def load(self):
+        if self.model is not None:
+            return
+        with self._load_lock:
+            if self.model is not None:
+                return
+            from llama_cpp import Llama
+
+            print(f"Loading {self.model_id} with llama.cpp...")
+            with span("llm.load_model"):
+                self.model = Llama(model_path=self.model_id, n_ctx=self.n_ctx,
+                                   n_threads=self.n_threads, verbose=False)
+            print("Model loaded successfully")
+
+    @staticmethod
+    def _options(params):
+        return {
+            "max_tokens": params["max_new_tokens"],
+            "temperature": params.get("temperature", 0.7) if params.get("do_sample") else 0.0,
+            "top_p": params.get("top_p", 1.0),
+        }
+
+    def _complete(self, prompt, params, stream=False):
+        return self.model.create_chat_completion(
+            messages=[{"role": "user", "content": prompt}],
+            stream=stream,
+            **self._options(params)
+        )
+
+    def generate(self, prompts, params):
+        texts = []
+        for prompt in prompts:
+            with span("llm.generate"):
+                response = self._complete(prompt, params)
+            texts.append(response["choices"][0]["message"]["content"].strip())
+        return texts
+
+    def stream(self, prompt, params):
+        with span("llm.generate"):
+            for chunk in self._complete(prompt, params, stream=True):
+                text = chunk["choices"][0]["delta"].get("content")
+                if text:
+                    yield text
+
+
+BACKENDS = {
+    "hf": HFBackend,
+    "int8": Int8Backend,
+    "llamacpp": LlamaCppBackend,
+}
+
+
+def make_backend(name=None, model_id=None, **options):
+    """Instantiate a backend by name; unknown ``options`` are ignored by backends that don't use them.
+
+    ``name`` and ``model_id`` default to ``PERSONA_BACKEND`` and ``PERSONA_MODEL_ID``.
+    """
+    name = name or os.getenv("PERSONA_BACKEND", DEFAULT_BACKEND)
+    model_id = model_id or os.getenv("PERSONA_MODEL_ID", DEFAULT_MODEL_ID)
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown persona backend {name!r}; expected one of {', '.join(BACKENDS)}")
+    return backend_class(model_id, **options)
 
 
 class WalletPersonaGenerator:
-    def __init__(self, hf_token=None):
-        """Initialize with the Mistral-7B-Instruct-v0.2 model
-        
+    def __init__(self, hf_token=None, model_id=None, batch_size=PERSONA_BATCH_SIZE,
+                 cache_path="", backend=None, **backend_options):
+        """Configure the generator; the model itself loads on first use (or ``warm_up``).
+
         Args:
             hf_token: Hugging Face API token for authentication (optional for this model)
+            model_id: Hub id or local path of the model (a .gguf file for ``llamacpp``);
+                defaults to ``PERSONA_MODEL_ID``
+            batch_size: Prompts per ``generate`` call in ``generate_personas``
+            cache_path: SQLite file for generated personas, by default ``PERSONA_CACHE_PATH``;
+                None disables the cache
+            backend: A name in ``BACKENDS`` or a backend instance; defaults to ``PERSONA_BACKEND``
+            backend_options: Passed to the backend, e.g. ``device_map=None`` to load
+                the ``hf`` backend on CPU without accelerate
         """
-        if hf_token:
-            login(token=hf_token, write_permission=False)
-
-        try:
-            print("Loading Mistral model pipeline...")
-            model_id = "mistralai/Mistral-7B-Instruct-v0.2"
-            self.tokenizer = AutoTokenizer.from_pretrained(model_id)
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_id,
-                device_map="auto",
-                torch_dtype="auto"
-            )
-            print("Model loaded successfully")
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            raise
+        if backend is None or isinstance(backend, str):
+            backend = make_backend(backend, model_id, hf_token=hf_token, **backend_options)
+        if cache_path == "":
+            cache_path = os.getenv("PERSONA_CACHE_PATH", PERSONA_CACHE_PATH)
+        self.backend = backend
+        self.model_id = backend.model_id
+        self.batch_size = batch_size
+        self.cache = ResponseCache(cache_path, default_ttl=PERSONA_CACHE_TTL) if cache_path else None
+
+    @property
+    def loaded(self):
+        return self.backend.loaded
+
+    def load(self):
+        """Load the backend's model once; concurrent callers wait for the first load."""
+        self.backend.load()
 
+    def warm_up(self, background=False):
+        """Load the model now instead of on the first request.
+
+        With ``background=True`` the load runs in a daemon thread (returned) so
+        startup work such as reading wallet data can overlap with it.
+        """
+        if not background:
+            self.load()
+            return None
+        thread = threading.Thread(target=self.load, name="persona-model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def generation_params(self, detailed=True):
+        """Sampling settings passed to the backend (and part of the cache key)."""
+        return {
+            "max_new_tokens": 800 if detailed else 300,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "do_sample": True,
+        }
+
+    def _cache_key(self, prompt, params):
+        return {"backend": self.backend.name, "model_id": self.model_id, "prompt": prompt, **params}
+
+    @traced("llm.generate_persona")
     def generate_persona(self, wallet_data, detailed=True):
-        """Generate a persona using Mistral-7B model."""
-        classifications = wallet_data.get('classifications', [])
-        short_addr = f"{wallet_data['address'][:6]}...{wallet_data['address'][-4:]}"
-        
-        if detailed:
-            content = (
-                f"Generate a detailed persona profile for crypto wallet {short_addr} based on the following on-chain data:\n"
-                f"- Total networth: ${wallet_data.get('total_networth', 0):,.2f}\n"
-                f"- Native balance: {wallet_data.get('native_balance', 0):,.2f}\n"
-                f"- Token balance: ${wallet_data.get('token_balance_usd', 0):,.2f}\n"
-                f"- Chain: {wallet_data.get('chain', 'unknown')}\n"
-                f"- Wallet Health Score: {wallet_data.get('wallet_health_score', 0)} / 100\n"
-                f"- Risk Score: {wallet_data.get('risk_score', 0)} / 100 (higher means riskier)\n"
-                f"- Activity Score: {wallet_data.get('activity_score', 0)} (aggregate transaction count)\n"
-                f"- Token Count: {wallet_data.get('token_count', 0)} tokens held\n"
-                f"- Top Tokens: {', '.join(wallet_data.get('top_tokens', [])) or 'None'}\n"
-                f"- DeFi Protocols: {wallet_data.get('defi_protocols', 0)} engaged\n"
-                f"- Total DeFi USD: ${wallet_data.get('total_defi_usd', 0):,.2f}\n"
-                f"- NFT Collections: {wallet_data.get('unique_nft_collections', 0)}\n"
-                f"- Classifications: {', '.join(classifications) if classifications else 'None'}\n"
-                f"- Social Handle: {wallet_data.get('social_handle', 'N/A')}\n"
-                f"\nFictional Persona Journey:\n{wallet_data.get('persona_journey', '')}\n\n"
-                f"Based on these, create a rich, fictional persona including:\n"
-                f"1. Crypto Identity: Who they are in the crypto ecosystem\n"
-                f"2. Trading Style: Their approach, time horizon, transaction patterns\n"
-                f"3. Risk Profile: Their comfort with different types of risk\n"
-                f"4. Blockchain Preferences: Why they choose this chain\n"
-                f"5. Personalized Recommendations: 3-4 specific products or strategies\n\n"
-                f"Format your response as a well-structured markdown document with headers for each section."
-            )
-        else:
-            content = (
-                f"Create a brief crypto persona for wallet {short_addr} with "
-                f"${wallet_data.get('total_networth', 0):,.2f} total worth on {wallet_data.get('chain', 'unknown')} chain. "
-                f"Include identity type, risk profile, and 1-2 recommendations."
-            )
+        """Generate a persona for one wallet."""
+        return self.generate_personas([wallet_data], detailed=detailed)[0]
 
-        messages = [{"role": "user", "content": content}]
-        print("Generating response with Mistral model...")
-
-        max_new_tokens = 800 if detailed else 300
-
-        input_ids = self.tokenizer.apply_chat_template(
-            messages,
-            return_tensors="pt"
-        ).to(self.model.device)
-
-        # Robust attention_mask and pad_token_id handling
-        pad_token_id = self.tokenizer.pad_token_id
-        if pad_token_id is None:
-            pad_token_id = self.tokenizer.eos_token_id
-        attention_mask = (input_ids != pad_token_id).long()
-        generated_ids = self.model.generate(
-            input_ids,
-            attention_mask=attention_mask,
-            max_new_tokens=max_new_tokens,
-            temperature=0.7,
-            top_p=0.9,
-            do_sample=True,
-            pad_token_id=pad_token_id
-        )
+    @traced("llm.generate_personas")
+    def generate_personas(self, wallets, detailed=True, batch_size=None, use_cache=True):
+        """Generate personas for a list of feature dicts, in order.
+
+        Cached outputs are served from disk without loading the model; the
+        remaining prompts are sorted by length (to keep padding small) and sent
+        to the backend ``batch_size`` at a time.
+        """
+        params = self.generation_params(detailed)
+        prompts = [build_persona_prompt(w, detailed) for w in wallets]
+        cache = self.cache if use_cache else None
+        keys = [self._cache_key(prompt, params) for prompt in prompts]
+
+        results = [None] * len(prompts)
+        if cache is not None:
+            with span("llm.cache_lookup"):
+                for i, key in enumerate(keys):
+                    results[i] = cache.get("persona", key)
+        pending = sorted((i for i, r in enumerate(results) if r is None), key=lambda i: len(prompts[i]))
+        if not pending:
+            return results
+
+        self.load()
+        print(f"Generating {len(pending)} persona(s) with {self.model_id} "
+              f"({len(prompts) - len(pending)} cached)...")
+        batch_size = batch_size or self.batch_size
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            texts = self.backend.generate([prompts[i] for i in batch], params)
+            for i, text in zip(batch, texts):
+                results[i] = text
+                if cache is not None:
+                    cache.set("persona", keys[i], text)
+        return results
+
+    def stream_persona(self, wallet_data, detailed=True, use_cache=True):
+        """Yield the persona for one wallet as decoded text chunks while it is generated.
+
+        A cached persona is yielded as a single chunk; a completed stream is
+        added to the cache.
+        """
+        params = self.generation_params(detailed)
+        prompt = build_persona_prompt(wallet_data, detailed)
+        cache = self.cache if use_cache else None
+        key = self._cache_key(prompt, params)
+        if cache is not None:
+            cached = cache.get("persona", key)
+            if cached is not None:
+                yield cached
+                return
 
-        generated_text = self.tokenizer.decode(generated_ids[0], skip_special_tokens=True)
+        self.load()
+        start = time.perf_counter()
+        chunks = []
+        for chunk in self.backend.stream(prompt, params):
+            if not chunks:
+                REGISTRY.observe("llm.time_to_first_token", time.perf_counter() - start)
+            chunks.append(chunk)
+            yield chunk
+        if cache is not None:
+            cache.set("persona", key, "".join(chunks).strip())
 
-        user_content = messages[-1]["content"]
 
-        if user_content in generated_text:
-            response_start = generated_text.find(user_content) + len(user_content)
-            response_text = generated_text[response_start:].strip()
-            response_text = response_text.replace("[/INST]", "").strip()
-        else:
-            response_text = generated_text.strip()
+def get_generator(**kwargs):
+    """The process-wide WalletPersonaGenerator, created on first call.
 
-        return response_text
+    Keyword arguments configure the instance the first time only; later
+    callers share it (and its loaded model) whatever they pass.
+    """
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = WalletPersonaGenerator(**kwargs)
+    return _generator